@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+# Serve the data source cache to other clocks on the LAN, without a display.
+#
+# Point clocks at the proxy by adding "base_url": "http://<proxy-host>:8081"
+# to the weather panel parameters. A clock can serve its own cache instead, by
+# adding a "cache_proxy" section, e.g. {"host": "0.0.0.0", "port": 8081}, to
+# its configuration. The proxy only listens on the loopback interface unless
+# a host address is given, e.g. "-b 0.0.0.0" for all interfaces.
+
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# Assume this script is in an immediate sub-folder of the base folder.
+BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, BASE_FOLDER)
+
+from rpiclock.utility import Config, DataSource, log
+from rpiclock.utility.cache_proxy import (CacheProxyServer,
+                                          DEFAULT_CACHE_PROXY_HOST,
+                                          DEFAULT_CACHE_PROXY_PORT,
+                                          DEFAULT_CACHE_PROXY_TTL,
+                                          DEFAULT_CACHE_PROXY_UPSTREAM_URL,
+                                          PROXY_CACHE_SUBFOLDER_NAME)
+
+
+def main():
+    parser = ArgumentParser(description='RPI-Clock LAN data source cache proxy')
+    parser.add_argument('-b', '--bind',
+                        default=DEFAULT_CACHE_PROXY_HOST,
+                        help=f'listening host address, e.g. 0.0.0.0 for all interfaces'
+                             f' (default: {DEFAULT_CACHE_PROXY_HOST})')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=DEFAULT_CACHE_PROXY_PORT,
+                        help=f'listening port (default: {DEFAULT_CACHE_PROXY_PORT})')
+    parser.add_argument('-u', '--upstream',
+                        default=DEFAULT_CACHE_PROXY_UPSTREAM_URL,
+                        help=f'upstream base URL (default: {DEFAULT_CACHE_PROXY_UPSTREAM_URL})')
+    parser.add_argument('-t', '--ttl',
+                        type=int,
+                        default=DEFAULT_CACHE_PROXY_TTL,
+                        help=f'cache lifetime in seconds when upstream specifies none'
+                             f' (default: {DEFAULT_CACHE_PROXY_TTL})')
+    parser.add_argument('-c', '--config',
+                        help='configuration file with a "data_sources" section to apply')
+    parser.add_argument('-f', '--cache-folder',
+                        dest='cache_folder',
+                        help=f'parent folder for the "{PROXY_CACHE_SUBFOLDER_NAME}" cache sub-folder,'
+                             f' overriding the configuration')
+    args = parser.parse_args()
+    log.setLevel(logging.INFO)
+    for handler in log.handlers:
+        handler.setLevel(logging.INFO)
+    data_sources_config = {}
+    if args.config:
+        data_sources_config = dict(Config(args.config).data_sources or {})
+    if args.cache_folder:
+        data_sources_config['cache_folder'] = args.cache_folder
+    # A clock on the same host may use the same configuration and cache folder.
+    data_sources_config['cache_subfolder'] = PROXY_CACHE_SUBFOLDER_NAME
+    DataSource.configure(**data_sources_config)
+    server = CacheProxyServer(port=args.port, host=args.bind, upstream_url=args.upstream, ttl=args.ttl)
+    log.info(f'Serving cache proxy for "{args.upstream}" on {args.bind}:{args.port}.')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write(os.linesep)
+        sys.exit(1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+# Serve recorded data source responses from a local stand-in server.
+#
+# Record responses by adding "record_folder" to the "data_sources"
+# configuration section. Then point the application at the replay server by
+# adding "base_url": "http://localhost:8080" to the weather panel parameters.
+
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# Assume this script is in an immediate sub-folder of the base folder.
+BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, BASE_FOLDER)
+
+from rpiclock.utility import log
+from rpiclock.utility.replay import ReplayServer, DEFAULT_REPLAY_PORT
+
+
+def main():
+    parser = ArgumentParser(description='RPI-Clock recorded response replay server')
+    parser.add_argument('folder',
+                        help='recordings folder')
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=DEFAULT_REPLAY_PORT,
+                        help=f'listening port (default: {DEFAULT_REPLAY_PORT})')
+    parser.add_argument('-l', '--latency',
+                        type=float,
+                        default=0,
+                        help='added latency in seconds')
+    parser.add_argument('-j', '--jitter',
+                        type=float,
+                        default=0,
+                        help='maximum random extra latency in seconds')
+    parser.add_argument('-r', '--recorded-latency',
+                        dest='recorded_latency',
+                        action='store_true',
+                        help='add originally-recorded request durations')
+    parser.add_argument('-e', '--error-rate',
+                        dest='error_rate',
+                        type=float,
+                        default=0,
+                        help='fraction of requests that fail with 503 errors')
+    parser.add_argument('-m', '--max-rate',
+                        dest='max_rate',
+                        type=float,
+                        help='maximum requests per second before 429 responses')
+    parser.add_argument('-s', '--seed',
+                        type=int,
+                        default=0,
+                        help='random number seed for reproducible runs')
+    args = parser.parse_args()
+    log.setLevel(logging.INFO)
+    for handler in log.handlers:
+        handler.setLevel(logging.INFO)
+    server = ReplayServer(args.folder,
+                          port=args.port,
+                          latency=args.latency,
+                          latency_jitter=args.jitter,
+                          recorded_latency=args.recorded_latency,
+                          error_rate=args.error_rate,
+                          max_rate=args.max_rate,
+                          seed=args.seed)
+    log.info(f'Serving on port {args.port}.')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.stderr.write(os.linesep)
+        sys.exit(1)
@@ -27,7 +27,8 @@ from typing import Type
 from rpiclock.drivers import DeviceDriver, RPIDriver
 from rpiclock.events import ButtonEvents, TickEvents, TimerEvents, TriggerEvents, EventProducersRegistry
 from rpiclock.screen import ScreensRegistry, Screen, Viewport
-from rpiclock.utility import Config, log, FontsFinder
+from rpiclock.utility import Config, log, FontsFinder, DataSource
+from rpiclock.utility.cache_proxy import CacheProxyServer
 
 DEFAULT_POLL_INTERVAL = 0.1
 
@@ -44,6 +45,7 @@ class MainController:
         self.instances += 1
         self.config = Config(config_path)
         self.poll_interval = self.config.poll_interval or DEFAULT_POLL_INTERVAL
+        self._initialize_data_sources()
         self.driver = self._initialize_driver()
         self.event_producers_registry = self._initialize_events()
         self.fonts_finder = FontsFinder(os.path.join(base_folder, 'fonts'))
@@ -61,6 +63,19 @@ class MainController:
         signal.signal(signal.SIGTERM, _signal_handler)
         signal.signal(signal.SIGINT, _signal_handler)
 
+    def _initialize_data_sources(self):
+        if self.config.data_sources:
+            try:
+                DataSource.configure(**self.config.data_sources)
+            except TypeError as exc:
+                log.error(f'Bad "data_sources" configuration: {exc}')
+        # Optionally serve the data source cache to other clocks on the LAN.
+        if self.config.cache_proxy:
+            try:
+                CacheProxyServer(**self.config.cache_proxy).start()
+            except (TypeError, OSError) as exc:
+                log.error(f'Bad "cache_proxy" configuration: {exc}')
+
     def _initialize_driver(self) -> DeviceDriver:
         # noinspection PyBroadException
         try:
@@ -86,6 +101,11 @@ class MainController:
                                           self.update,
                                           self.config.update_interval,
                                           permanent=True)
+        if DataSource.metrics_interval:
+            event_producers_registry.register('timer',
+                                              DataSource.log_metrics,
+                                              DataSource.metrics_interval,
+                                              permanent=True)
         event_producers_registry.register('trigger',
                                           self.activate_screen,
                                           'screen',
@@ -17,7 +17,7 @@
 
 """Display representing a physical screen device."""
 
-from rpiclock.utility import Rect, Font, Dimensions
+from rpiclock.utility import Rect, Font, Dimensions, ImageData
 from rpiclock.utility.typing import Color
 
 
@@ -79,11 +79,22 @@ class Display:
         """
         raise NotImplementedError
 
-    def render_image(self, path: str, rect: Rect):
+    def render_image(self, path: str, rect: Rect, source_rect: Rect = None):
         """
         Render image file.
 
         :param path: image file path
         :param rect: image display rectangle
+        :param source_rect: optional part of the image to render, e.g. an atlas tile
+        """
+        raise NotImplementedError
+
+    def render_image_data(self, image_data: ImageData, rect: Rect, source_rect: Rect = None):
+        """
+        Render decoded image data.
+
+        :param image_data: decoded RGBA image data
+        :param rect: image display rectangle
+        :param source_rect: optional part of the image to render, e.g. an atlas tile
         """
         raise NotImplementedError
@@ -19,8 +19,10 @@
 
 import os
 import pygame
+from typing import Dict, Tuple
+from weakref import WeakKeyDictionary
 
-from rpiclock.utility import Font, Dimensions, Rect
+from rpiclock.utility import Font, Dimensions, Rect, ImageData
 from rpiclock.utility.typing import Color
 
 from .display import Display
@@ -63,6 +65,10 @@ class PygameDisplay(Display):
         pygame.display.init()
         pygame.mouse.set_visible(False)
         self.surface = pygame.display.set_mode((self.rect.width, self.rect.height))
+        # Loaded image surfaces and file modification times by path.
+        self.images: Dict[str, Tuple[int, pygame.Surface]] = {}
+        # Converted surfaces by image data, for image data that is still in use.
+        self.image_data_surfaces = WeakKeyDictionary()
 
     def shut_down(self):
         """Required override to handle clean shutdown."""
@@ -113,18 +119,52 @@ class PygameDisplay(Display):
         self.surface.fill(color, _make_pygame_rect(rect))
         pygame.display.update()
 
-    def render_image(self, path: str, rect: Rect):
+    def render_image(self, path: str, rect: Rect, source_rect: Rect = None):
         """
         Render image file.
 
+        Loaded images are kept until the file changes, so that e.g. atlas
+        tiles are rendered without re-reading the file.
+
         :param path: image file path
         :param rect: image display rectangle
+        :param source_rect: optional part of the image to render, e.g. an atlas tile
         """
-        image_surface = pygame.image.load(path)
-        # Supposedly speeds rendering to let surface perform conversion.
-        if path.lower().endswith('.png'):
-            image_surface = image_surface.convert_alpha()
+        modified_time = os.stat(path).st_mtime_ns
+        loaded_image = self.images.get(path)
+        if loaded_image is not None and loaded_image[0] == modified_time:
+            image_surface = loaded_image[1]
         else:
-            image_surface = image_surface.convert()
-        self.surface.blit(image_surface, _make_pygame_rect(rect))
+            image_surface = pygame.image.load(path)
+            # Supposedly speeds rendering to let surface perform conversion.
+            if path.lower().endswith('.png'):
+                image_surface = image_surface.convert_alpha()
+            else:
+                image_surface = image_surface.convert()
+            self.images[path] = (modified_time, image_surface)
+        self.surface.blit(image_surface,
+                          _make_pygame_rect(rect),
+                          _make_pygame_rect(source_rect) if source_rect is not None else None)
+        pygame.display.update()
+
+    def render_image_data(self, image_data: ImageData, rect: Rect, source_rect: Rect = None):
+        """
+        Render decoded image data.
+
+        The pixel buffer is wrapped without copying, and converted to the
+        display format once for as long as the image data is in use.
+
+        :param image_data: decoded RGBA image data
+        :param rect: image display rectangle
+        :param source_rect: optional part of the image to render, e.g. an atlas tile
+        """
+        image_surface = self.image_data_surfaces.get(image_data)
+        if image_surface is None:
+            image_surface = pygame.image.frombuffer(image_data.pixels,
+                                                    (image_data.width, image_data.height),
+                                                    'RGBA').convert_alpha()
+            self.image_data_surfaces[image_data] = image_surface
+        self.surface.blit(image_surface,
+                          _make_pygame_rect(rect),
+                          _make_pygame_rect(source_rect) if source_rect is not None else None)
         pygame.display.update()
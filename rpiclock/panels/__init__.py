@@ -18,7 +18,7 @@
 """Panels package."""
 
 # Hard-import all panel modules to allow Panel classes to self-register.
-from . import message, time, weather
+from . import alerts, forecast, message, time, weather
 
 from .message import MessagePanel
 from .registry import PanelRegistry
@@ -0,0 +1,212 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Weather alerts panel."""
+
+from time import time
+from typing import Dict, Optional, Tuple
+
+from rpiclock.events import EventProducersRegistry
+from rpiclock.screen import Panel, Viewport
+from rpiclock.utility import DataSource, JSONDataSource, DataSourceRegistry, log
+
+from .noaa_records import Alert, decode_alerts
+from .registry import PanelRegistry
+from .weather_model import BASE_URL
+
+ALERTS_SOURCE_NAME = 'weather-alerts'
+ALERTS_SUB_URL = '/alerts/active?point={latitude:.4f},{longitude:.4f}'
+ALERTS_SCHEMA = {
+    'features': [{
+        'properties': {
+            'id': str,
+            'event': str,
+        }
+    }]
+}
+ALERTS_PROJECTION = [
+    'features.properties.id',
+    'features.properties.event',
+    'features.properties.headline',
+    'features.properties.severity',
+    'features.properties.sent',
+    'features.properties.expires',
+]
+# Poll often while alerts are active, and back off gradually while none are.
+# Expired cache data is revalidated with conditional requests.
+ALERTS_ACTIVE_POLL_FREQUENCY = 60
+ALERTS_IDLE_POLL_FREQUENCY = 120
+ALERTS_IDLE_POLL_FREQUENCY_MAX = 900
+ALERTS_CACHE_TIMEOUT = ALERTS_ACTIVE_POLL_FREQUENCY
+# Most severe first.
+SEVERITY_ORDER = ['Extreme', 'Severe', 'Moderate', 'Minor', 'Unknown']
+
+
+@PanelRegistry.register('alerts')
+class AlertsPanel(Panel):
+    """NOAA active weather alerts panel."""
+
+    def __init__(self,
+                 latitude: float,
+                 longitude: float,
+                 domain: str,
+                 email: str,
+                 base_url: str = BASE_URL,
+                 none_text: str = ''):
+        """
+        Alerts panel constructor.
+
+        Takes the same location and identification parameters as the weather
+        panel. Displays the most severe active alert's event name, followed by
+        the number of other active alerts, if any.
+
+        :param latitude: alerts location latitude
+        :param longitude: alerts location longitude
+        :param domain: domain for user agent string as ID for NOAA API
+        :param email: email for user agent string as ID for NOAA API
+        :param base_url: NOAA API base URL, e.g. to use a local replay server
+        :param none_text: text to display when there are no active alerts
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.base_url = base_url
+        self.none_text = none_text
+        self.user_agent = f'({domain}, {email})'
+        # Initialized in on_initialize().
+        self.alerts_data_source: Optional[JSONDataSource] = None
+        # Active alerts by alert ID.
+        self.alerts: Dict[str, Alert] = {}
+        self.idle_poll_frequency = ALERTS_IDLE_POLL_FREQUENCY
+        self.next_poll_time = 0.0
+        self.ready = False
+
+    def do_update(self):
+        """Called for initial and periodic updates, which poll when due."""
+        now = time()
+        # Allow half a tick of slack, because ticks may come slightly before
+        # the poll time, e.g. the first tick after the initial update.
+        if now + self.get_poll_interval(ALERTS_ACTIVE_POLL_FREQUENCY) / 2 < self.next_poll_time:
+            return
+        alerts: Optional[Tuple[Alert, ...]] = self.alerts_data_source.download(latitude=self.latitude,
+                                                                               longitude=self.longitude)
+        if alerts is None:
+            # Keep the current alerts, but drop any that expired.
+            alerts = tuple(self.alerts.values())
+        new_alerts = {alert.alert_id: alert for alert in alerts
+                      if not alert.expires or alert.expires > now}
+        if self.diff_alerts(new_alerts):
+            self.ready = True
+        self.alerts = new_alerts
+        if self.alerts:
+            self.idle_poll_frequency = ALERTS_IDLE_POLL_FREQUENCY
+            self.next_poll_time = now + self.get_poll_interval(ALERTS_ACTIVE_POLL_FREQUENCY)
+        else:
+            self.next_poll_time = now + self.get_poll_interval(self.idle_poll_frequency)
+            self.idle_poll_frequency = min(self.idle_poll_frequency * 2, ALERTS_IDLE_POLL_FREQUENCY_MAX)
+
+    @staticmethod
+    def get_poll_interval(frequency: float) -> float:
+        """
+        Apply per-device jitter to a poll frequency.
+
+        :param frequency: poll frequency in seconds
+        :return: jittered poll interval in seconds
+        """
+        return DataSource.jitter.apply(frequency, ALERTS_SOURCE_NAME)
+
+    def diff_alerts(self, new_alerts: Dict[str, Alert]) -> bool:
+        """
+        Compare new alerts to the current alerts, and log changes.
+
+        :param new_alerts: new active alerts by alert ID
+        :return: True if any alerts were added, updated, or expired
+        """
+        changed = False
+        for alert_id, alert in new_alerts.items():
+            old_alert = self.alerts.get(alert_id)
+            if old_alert is None:
+                log.info(f'Weather alert added: {alert.event} ({alert_id})')
+                changed = True
+            elif alert != old_alert:
+                log.info(f'Weather alert updated: {alert.event} ({alert_id})')
+                changed = True
+        for alert_id, alert in self.alerts.items():
+            if alert_id not in new_alerts:
+                log.info(f'Weather alert expired: {alert.event} ({alert_id})')
+                changed = True
+        return changed
+
+    def get_text(self) -> str:
+        """
+        Get display text for the active alerts.
+
+        :return: display text
+        """
+        if not self.alerts:
+            return self.none_text
+
+        def _get_sort_key(alert: Alert) -> Tuple[int, str]:
+            if alert.severity in SEVERITY_ORDER:
+                severity_index = SEVERITY_ORDER.index(alert.severity)
+            else:
+                severity_index = len(SEVERITY_ORDER)
+            return severity_index, alert.event
+
+        alert = min(self.alerts.values(), key=_get_sort_key)
+        if len(self.alerts) == 1:
+            return alert.event
+        return f'{alert.event} (+{len(self.alerts) - 1})'
+
+    def on_initialize(self, event_producers_registry: EventProducersRegistry, viewport: Viewport):
+        """
+        Register handled events.
+
+        :param event_producers_registry: event manager
+        :param viewport: display viewport
+        """
+        self.alerts_data_source = DataSourceRegistry.get(JSONDataSource,
+                                                         ALERTS_SOURCE_NAME,
+                                                         self.base_url,
+                                                         ALERTS_SUB_URL,
+                                                         frequency=ALERTS_CACHE_TIMEOUT,
+                                                         schema=ALERTS_SCHEMA,
+                                                         projection=ALERTS_PROJECTION,
+                                                         decoder=decode_alerts,
+                                                         user_agent=self.user_agent)
+        # The timer runs at the fastest poll frequency, and do_update() skips early ticks.
+        event_producers_registry.register('timer',
+                                          self.do_update,
+                                          self.get_poll_interval(ALERTS_ACTIVE_POLL_FREQUENCY))
+        self.do_update()
+        self.ready = True
+
+    def on_display(self, viewport: Viewport):
+        """
+        Display the most severe active alert in a viewport.
+
+        :param viewport: viewport for display
+        """
+        viewport.text(self.get_text())
+        self.ready = False
+
+    def on_check(self) -> bool:
+        """
+        Check if data is ready for display.
+
+        :return: True if data is ready
+        """
+        return self.ready
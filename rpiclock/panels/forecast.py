@@ -0,0 +1,225 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Hourly forecast panel."""
+
+from bisect import bisect_right
+from time import localtime, strftime, time
+from typing import Optional
+
+from rpiclock.events import EventProducersRegistry
+from rpiclock.screen import Panel, Viewport
+from rpiclock.utility import DataSource, JSONDataSource, DataSourceRegistry, Rect, log
+
+from .noaa_records import HourlyForecast, decode_hourly_forecast
+from .registry import PanelRegistry
+from .weather import ICON_FORMAT, format_temperature
+from .weather_icons import WeatherIcons
+from .weather_model import BASE_URL, WeatherError, WeatherModel
+
+# Checks for a new forecast or a new hour. The data source is cached.
+POLL_FREQUENCY = 60
+FORECAST_SOURCE_NAME = 'weather-forecast'
+FORECAST_CACHE_TIMEOUT = 1800   # refresh every 30 minutes
+FORECAST_SUB_URL = '/gridpoints/{wfo}/{x},{y}/forecast/hourly'
+FORECAST_SCHEMA = {
+    'properties': {
+        'periods': [{
+            'startTime': str,
+            'temperature': float,
+        }]
+    }
+}
+FORECAST_PROJECTION = [
+    'properties.periods.startTime',
+    'properties.periods.temperature',
+    'properties.periods.temperatureUnit',
+    'properties.periods.probabilityOfPrecipitation.value',
+    'properties.periods.icon',
+]
+PERIOD_DURATION = 3600
+DEFAULT_HOURS = 6
+DEFAULT_HOUR_FORMAT = '%H %T %P'
+HOUR_SEPARATOR = '  '
+
+
+@PanelRegistry.register('forecast')
+class ForecastPanel(Panel):
+    """NOAA hourly forecast panel, showing a rolling window of upcoming hours."""
+
+    # noinspection PyShadowingBuiltins
+    def __init__(self,
+                 latitude: float,
+                 longitude: float,
+                 domain: str,
+                 email: str,
+                 format: str = DEFAULT_HOUR_FORMAT,
+                 hours: int = DEFAULT_HOURS,
+                 metric: bool = False,
+                 base_url: str = BASE_URL):
+        """
+        Forecast panel constructor.
+
+        Takes the same location and identification parameters as the weather
+        panel, and shares its grid point lookup.
+
+        The format string is applied to each hour in the window, starting
+        with the current hour, and the results are joined. It accepts these
+        strftime-like codes:
+
+        %H: hour, e.g. "3pm"
+        %T: temperature
+        %P: precipitation chance
+
+        The special "%I" format displays the conditions icon for the last
+        hour in the window instead.
+
+        :param latitude: forecast location latitude
+        :param longitude: forecast location longitude
+        :param domain: domain for user agent string as ID for NOAA API
+        :param email: email for user agent string as ID for NOAA API
+        :param format: format string for each hour
+        :param hours: number of hours to display
+        :param metric: use metric (Celsius) units instead of Fahrenheit
+        :param base_url: NOAA API base URL, e.g. to use a local replay server
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.hour_format = format
+        self.hours = hours
+        self.metric = metric
+        self.base_url = base_url
+        self.user_agent = f'({domain}, {email})'
+        # Initialized in on_initialize().
+        self.model: Optional[WeatherModel] = None
+        self.forecast_data_source: Optional[JSONDataSource] = None
+        self.icons: Optional[WeatherIcons] = None
+        self.text: Optional[str] = None
+        self.icon_key: Optional[str] = None
+        self.icon_tile: Optional[Rect] = None
+        self.ready = False
+
+    def do_update(self):
+        """Called for initial and periodic updates."""
+        text: Optional[str] = '--'
+        icon_key: Optional[str] = None
+        try:
+            forecast = self.get_forecast()
+            # The window starts with the current hour.
+            start_idx = bisect_right(forecast.times, time() - PERIOD_DURATION)
+            end_idx = min(start_idx + self.hours, len(forecast.times))
+            if start_idx < end_idx:
+                if self.hour_format == ICON_FORMAT:
+                    icon_key = forecast.icon_keys[forecast.icon_indexes[end_idx - 1]] or None
+                    if icon_key:
+                        text = None
+                else:
+                    text = HOUR_SEPARATOR.join(self.format_hour(forecast, period_idx)
+                                               for period_idx in range(start_idx, end_idx))
+        except WeatherError as exc:
+            log.error(f'Forecast retrieval error: {str(exc)}')
+        if text != self.text or icon_key != self.icon_key:
+            self.text = text
+            self.icon_key = icon_key
+            self.icon_tile = self.icons.get_tile(icon_key) if icon_key else None
+            self.ready = True
+
+    def get_forecast(self) -> HourlyForecast:
+        """
+        Download the hourly forecast.
+
+        :return: hourly forecast record
+        """
+        grid_point = self.model.noaa_params.grid_point
+        forecast = self.forecast_data_source.download(wfo=grid_point.wfo, x=grid_point.x, y=grid_point.y)
+        if forecast is None:
+            raise WeatherError('NOAA returned no hourly forecast data')
+        return forecast
+
+    def format_hour(self, forecast: HourlyForecast, period_idx: int) -> str:
+        """
+        strftime-like formatting for one forecast hour.
+
+        :param forecast: hourly forecast record
+        :param period_idx: forecast period index
+        :return: formatted string
+        """
+        text = self.hour_format
+        if '%H' in text:
+            hour_text = strftime('%I%p', localtime(forecast.times[period_idx]))
+            text = text.replace('%H', hour_text.lstrip('0').lower())
+        if '%T' in text:
+            text = text.replace('%T', format_temperature(forecast.temperatures[period_idx], self.metric))
+        if '%P' in text:
+            text = text.replace('%P', f'{forecast.precipitation_chances[period_idx]}%')
+        return text
+
+    def on_initialize(self, event_producers_registry: EventProducersRegistry, viewport: Viewport):
+        """
+        Register handled events.
+
+        :param event_producers_registry: event manager
+        :param viewport: display viewport
+        """
+        # The shared weather model provides the grid point lookup.
+        self.model = WeatherModel.get(self.latitude, self.longitude, self.base_url, self.user_agent)
+        self.forecast_data_source = DataSourceRegistry.get(JSONDataSource,
+                                                           FORECAST_SOURCE_NAME,
+                                                           self.base_url,
+                                                           FORECAST_SUB_URL,
+                                                           frequency=FORECAST_CACHE_TIMEOUT,
+                                                           schema=FORECAST_SCHEMA,
+                                                           projection=FORECAST_PROJECTION,
+                                                           decoder=decode_hourly_forecast,
+                                                           user_agent=self.user_agent)
+        if self.hour_format == ICON_FORMAT:
+            self.icons = WeatherIcons.get(self.base_url,
+                                          self.user_agent,
+                                          (viewport.inner_rect.width, viewport.inner_rect.height))
+            self.icons.start_prefetch()
+        event_producers_registry.register('timer',
+                                          self.do_update,
+                                          DataSource.jitter.apply(POLL_FREQUENCY, FORECAST_SOURCE_NAME))
+        self.do_update()
+
+    def on_display(self, viewport: Viewport):
+        """
+        Display the forecast window in a viewport.
+
+        :param viewport: viewport for display
+        """
+        if self.icon_key:
+            if self.icon_tile:
+                viewport.image(self.icons.atlas.get_image_data(), source_rect=self.icon_tile)
+            else:
+                viewport.text('(no icon)')
+        else:
+            viewport.text(self.text)
+        self.ready = False
+
+    def on_check(self) -> bool:
+        """
+        Check if data is ready for display.
+
+        :return: True if data is ready
+        """
+        if self.icon_key and self.icon_tile is None:
+            # Retry icons that were unavailable, e.g. due to a network error.
+            self.icon_tile = self.icons.get_tile(self.icon_key)
+            if self.icon_tile is not None:
+                self.ready = True
+        return self.ready
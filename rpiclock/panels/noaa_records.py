@@ -0,0 +1,223 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compact NOAA API records and the decoders that build them from JSON data."""
+
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .weather_icons import get_icon_key
+
+
+@dataclass
+class GridPoint:
+    """NOAA forecast office grid point for a location."""
+    __slots__ = ('wfo', 'x', 'y')
+    wfo: str
+    """Weather forecast office ID."""
+    x: int
+    """Grid X coordinate."""
+    y: int
+    """Grid Y coordinate."""
+
+
+@dataclass
+class Station:
+    """NOAA observation station."""
+    __slots__ = ('station_id',)
+    station_id: str
+    """Station ID, e.g. "KBOS"."""
+
+
+@dataclass
+class Observation:
+    """Latest observation from a NOAA station, with None for missing values."""
+    __slots__ = ('timestamp', 'description', 'temperature', 'icon', 'time', 'complete')
+    timestamp: Optional[str]
+    """ISO 8601 observation timestamp."""
+    description: Optional[str]
+    """Conditions description."""
+    temperature: Optional[float]
+    """Temperature in degrees Celsius."""
+    icon: Optional[str]
+    """Conditions icon URL."""
+    time: float
+    """Observation time in seconds since the epoch, or 0 if unknown."""
+    complete: bool
+    """True if no values are missing."""
+
+
+@dataclass
+class HourlyForecast:
+    """
+    NOAA hourly forecast periods in parallel array columns.
+
+    Columns are indexed by period, in time order.
+    """
+    __slots__ = ('times', 'temperatures', 'precipitation_chances', 'icon_indexes', 'icon_keys')
+    times: array
+    """Period start times in seconds since the epoch ('d' array)."""
+    temperatures: array
+    """Temperatures in degrees Celsius ('f' array)."""
+    precipitation_chances: array
+    """Precipitation chances in percent, 0 if unknown ('B' array)."""
+    icon_indexes: array
+    """Indexes into icon_keys ('H' array)."""
+    icon_keys: Tuple[str, ...]
+    """Distinct icon keys from get_icon_key(), or "" for unrecognized icons."""
+
+
+def decode_grid_point(data: Any) -> GridPoint:
+    """
+    Decode NOAA /points data.
+
+    :param data: JSON data, checked against the points schema
+    :return: grid point record
+    """
+    properties = data['properties']
+    return GridPoint(properties['gridId'], properties['gridX'], properties['gridY'])
+
+
+def decode_stations(data: Any) -> Tuple[Station, ...]:
+    """
+    Decode NOAA /gridpoints/.../stations data.
+
+    :param data: JSON data, checked against the stations schema
+    :return: station records, nearest first
+    """
+    return tuple(Station(url.split('/')[-1]) for url in data['observationStations'])
+
+
+def decode_observation(data: Any) -> Observation:
+    """
+    Decode NOAA /stations/.../observations/latest data.
+
+    Stations often report observations with missing values, so unexpected
+    types, values, and structure are tolerated below the top-level properties.
+
+    :param data: JSON data
+    :return: observation record
+    :raise: ValueError if there are no observation properties
+    """
+    properties = data.get('properties') if isinstance(data, dict) else None
+    if not isinstance(properties, dict):
+        raise ValueError('NOAA observations data missing properties')
+    timestamp = properties.get('timestamp')
+    observation_time = 0.0
+    if timestamp and isinstance(timestamp, str):
+        try:
+            observation_time = datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            timestamp = None
+    else:
+        timestamp = None
+    description = properties.get('textDescription')
+    if not description or not isinstance(description, str):
+        description = None
+    temperature: Optional[float] = None
+    temperature_data = properties.get('temperature')
+    if isinstance(temperature_data, dict):
+        temperature_value = temperature_data.get('value')
+        if isinstance(temperature_value, (int, float)):
+            # NOAA reports Celsius, as "wmoUnit:degC" or the older "unit:degC".
+            unit_code = temperature_data.get('unitCode')
+            if isinstance(unit_code, str) and unit_code.endswith(':degF'):
+                temperature = (temperature_value - 32) / 1.8
+            else:
+                temperature = float(temperature_value)
+    icon = properties.get('icon')
+    if not icon or not isinstance(icon, str):
+        icon = None
+    complete = None not in (timestamp, description, temperature, icon)
+    return Observation(timestamp, description, temperature, icon, observation_time, complete)
+
+
+@dataclass
+class Alert:
+    """Active NOAA weather alert."""
+    __slots__ = ('alert_id', 'event', 'headline', 'severity', 'sent', 'expires')
+    alert_id: str
+    """Alert ID, unique for each alert message."""
+    event: str
+    """Event name, e.g. "Winter Storm Warning"."""
+    headline: Optional[str]
+    """Headline text."""
+    severity: Optional[str]
+    """Severity, i.e. "Extreme", "Severe", "Moderate", "Minor", or "Unknown"."""
+    sent: Optional[str]
+    """ISO 8601 time the alert message was sent."""
+    expires: float
+    """Expiration time in seconds since the epoch, or 0 if unknown."""
+
+
+def decode_alerts(data: Any) -> Tuple[Alert, ...]:
+    """
+    Decode NOAA /alerts/active data.
+
+    :param data: JSON data, checked against the alerts schema
+    :return: alert records
+    """
+    alerts: List[Alert] = []
+    for feature in data['features']:
+        properties = feature['properties']
+        expires = 0.0
+        expires_text = properties.get('expires')
+        if expires_text and isinstance(expires_text, str):
+            try:
+                expires = datetime.fromisoformat(expires_text).timestamp()
+            except ValueError:
+                pass
+        alerts.append(Alert(properties['id'],
+                            properties['event'],
+                            _get_string(properties, 'headline'),
+                            _get_string(properties, 'severity'),
+                            _get_string(properties, 'sent'),
+                            expires))
+    return tuple(alerts)
+
+
+def _get_string(properties: Dict[str, Any], name: str) -> Optional[str]:
+    value = properties.get(name)
+    return value if value and isinstance(value, str) else None
+
+
+def decode_hourly_forecast(data: Any) -> HourlyForecast:
+    """
+    Decode NOAA /gridpoints/.../forecast/hourly data.
+
+    :param data: JSON data, checked against the hourly forecast schema
+    :return: hourly forecast record
+    :raise: ValueError for a bad period start time
+    """
+    forecast = HourlyForecast(array('d'), array('f'), array('B'), array('H'), ())
+    icon_keys: Dict[str, int] = {}
+    for period in data['properties']['periods']:
+        forecast.times.append(datetime.fromisoformat(period['startTime']).timestamp())
+        temperature = float(period['temperature'])
+        if period.get('temperatureUnit') == 'F':
+            temperature = (temperature - 32) / 1.8
+        forecast.temperatures.append(temperature)
+        chance_data = period.get('probabilityOfPrecipitation')
+        chance = chance_data.get('value') if isinstance(chance_data, dict) else None
+        forecast.precipitation_chances.append(chance if isinstance(chance, int) and 0 <= chance <= 100 else 0)
+        icon = period.get('icon')
+        icon_key = (get_icon_key(icon) if isinstance(icon, str) else None) or ''
+        forecast.icon_indexes.append(icon_keys.setdefault(icon_key, len(icon_keys)))
+    forecast.icon_keys = tuple(icon_keys)
+    return forecast
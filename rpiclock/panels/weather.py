@@ -17,109 +17,67 @@
 
 """Weather panel."""
 
-from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Set
 
 from rpiclock.events import EventProducersRegistry
 from rpiclock.screen import Panel, Viewport
-from rpiclock.utility import JSONDataSource, ImageDataSource, log
+from rpiclock.utility import Rect, log
 
 from .registry import PanelRegistry
-
-# It's okay to poll more often, because the data source is cached.
-POLL_FREQUENCY = 60
-BASE_URL = 'https://api.weather.gov'
-
-# Points are never automatically refreshed.
-POINTS_SOURCE_NAME = 'weather-points'
-POINTS_CACHE_TIMEOUT = 0        # 0 == use forever
-POINTS_SUB_URL = '/points/{latitude:.4f},{longitude:.4f}'
-POINTS_SCHEMA = {
-    'properties': {
-        'gridId': str,
-        'gridX': int,
-        'gridY': int
-    }
-}
-
-STATIONS_SOURCE_NAME = 'weather-stations'
-STATIONS_CACHE_TIMEOUT = 900    # refresh every 15 minutes
-STATIONS_SUB_URL = '/gridpoints/{wfo}/{x},{y}/stations'
-STATIONS_SCHEMA = {
-    'observationStations': []
-}
-
-OBSERVATIONS_SOURCE_NAME = 'weather-observations'
-OBSERVATIONS_CACHE_TIMEOUT = 900    # refresh every 15 minutes
-OBSERVATIONS_SUB_URL = '/stations/{station}/observations/latest'
-OBSERVATIONS_SCHEMA = {
-    'properties': {
-        'timestamp': str,
-        'textDescription': str,
-        'temperature': {
-            'value': float,
-            'unitCode': str,
-        },
-        'icon': str,
-    }
-}
-
-ICON_SOURCE_NAME = 'weather-icon'
-ICON_CACHE_TIMEOUT = 2592000    # refresh icon images every 30 days
-ICON_EXTENSION = '.png'
-
+from .weather_icons import WeatherIcons, get_icon_key
+from .weather_model import BASE_URL, WeatherModel
 
 # Special format string to display a conditions icon.
 ICON_FORMAT = '%I'
+# Observation fields rendered by format string codes.
+FORMAT_FIELDS = {
+    '%S': 'timestamp',
+    '%T': 'temperature',
+    '%D': 'description',
+}
 
 
-@dataclass
-class NOAAParams:
-    """NOAA parameters for identifying weather source."""
-    wfo: str
-    x: int
-    y: int
-    station: str
-
-
-@dataclass
-class NOAAObservations:
-    """Broken-out NOAA observation data."""
-
-    timestamp: str
-    description: str
-    temperature: str
-    icon: str
-
-    def format(self, template: str) -> str:
-        """
-        strftime-like formatting
-
-        %S: timestamp
-        %T: temperature
-        %D: description
-
-        :param template: template string
-        :return: formatted string
-        """
-        text = template
-        if '%S' in text:
-            text = text.replace('%S', self.timestamp)
-        if '%T' in text:
-            text = text.replace('%T', self.temperature)
-        if '%D' in text:
-            text = text.replace('%D', self.description)
-        return text
-
-
-class WeatherError(Exception):
-    """Weather retrieval exception used internally."""
-    pass
+def format_temperature(temperature: Optional[float], metric: bool) -> str:
+    """
+    Format a temperature for display.
+
+    :param temperature: temperature in degrees Celsius or None if unknown
+    :param metric: use metric (Celsius) units instead of Fahrenheit
+    :return: formatted temperature
+    """
+    if temperature is None:
+        return '--'
+    if not metric:
+        temperature = temperature * 1.8 + 32
+    return f'{round(temperature)}\u00b0'
+
+
+def format_observations(model: WeatherModel, template: str, metric: bool) -> str:
+    """
+    strftime-like formatting
+
+    %S: timestamp
+    %T: temperature
+    %D: description
+
+    :param model: weather model with the latest observations
+    :param template: template string
+    :param metric: use metric (Celsius) units instead of Fahrenheit
+    :return: formatted string
+    """
+    text = template
+    if '%S' in text:
+        text = text.replace('%S', model.get_field('timestamp') or '--')
+    if '%T' in text:
+        text = text.replace('%T', format_temperature(model.get_field('temperature'), metric))
+    if '%D' in text:
+        text = text.replace('%D', model.get_field('description') or '--')
+    return text
 
 
 @PanelRegistry.register('weather')
 class WeatherPanel(Panel):
-    """NOAA weather panel."""
+    """NOAA weather panel, a view of the shared location weather model."""
 
     # noinspection PyShadowingBuiltins
     def __init__(self,
@@ -128,7 +86,8 @@ class WeatherPanel(Panel):
                  format: str,
                  domain: str,
                  email: str,
-                 metric: bool = False):
+                 metric: bool = False,
+                 base_url: str = BASE_URL):
         """
         Weather panel constructor.
 
@@ -147,140 +106,70 @@ class WeatherPanel(Panel):
         :param domain: domain for user agent string as ID for NOAA API
         :param email: email for user agent string as ID for NOAA API
         :param metric: use metric (Celsius) units instead of Fahrenheit
+        :param base_url: NOAA API base URL, e.g. to use a local replay server
         """
         self.latitude = latitude
         self.longitude = longitude
         self.weather_format = format
         self.metric = metric
+        self.base_url = base_url
         self.user_agent = f'({domain}, {email})'
         # Initialized in on_initialize().
-        self.points_data_source: Optional[JSONDataSource] = None
-        self.stations_data_source: Optional[JSONDataSource] = None
-        self.observations_data_source: Optional[JSONDataSource] = None
-        # No URL here, because download request provides entire URL.
-        self.icon_data_source: Optional[ImageDataSource] = None
+        self.model: Optional[WeatherModel] = None
+        self.icons: Optional[WeatherIcons] = None
         self.text: Optional[str] = None
-        self.icon_url: Optional[str] = None
-        self.icon_path: Optional[str] = None
+        self.icon_key: Optional[str] = None
+        self.icon_tile: Optional[Rect] = None
         self.ready = False
-        self._noaa_params: Optional[NOAAParams] = None
 
-    def do_update(self):
-        """Called for initial and periodic updates."""
-        self.icon_url = self.icon_path = None
-        try:
-            observations = self.get_latest_observations()
-            if self.weather_format == ICON_FORMAT:
-                if observations.icon:
-                    self.text = None
-                    self.icon_url = observations.icon
-                    if self.icon_url:
-                        self.icon_path = self.icon_data_source.download(self.icon_url)
-            else:
-                self.text = observations.format(self.weather_format)
-        except WeatherError as exc:
-            self.text = '--'
-            log.error(f'Weather retrieval error: {str(exc)}')
-        self.ready = True
-
-    def on_initialize(self, event_producers_registry: EventProducersRegistry, viewport: Viewport):
+    def get_fields(self) -> Set[str]:
         """
-        Register handled events.
+        Get the observation fields rendered by the format string.
 
-        :param event_producers_registry: event manager
-        :param viewport: display viewport
+        :return: observation field names
         """
-        self.points_data_source = JSONDataSource(POINTS_SOURCE_NAME,
-                                                 BASE_URL,
-                                                 POINTS_SUB_URL,
-                                                 frequency=POINTS_CACHE_TIMEOUT,
-                                                 schema=POINTS_SCHEMA,
-                                                 user_agent=self.user_agent)
-        self.stations_data_source = JSONDataSource(STATIONS_SOURCE_NAME,
-                                                   BASE_URL,
-                                                   STATIONS_SUB_URL,
-                                                   frequency=STATIONS_CACHE_TIMEOUT,
-                                                   user_agent=self.user_agent)
-        self.observations_data_source = JSONDataSource(OBSERVATIONS_SOURCE_NAME,
-                                                       BASE_URL,
-                                                       OBSERVATIONS_SUB_URL,
-                                                       frequency=OBSERVATIONS_CACHE_TIMEOUT,
-                                                       user_agent=self.user_agent)
-        # No URL here, because download request provides entire URL.
-        self.icon_data_source = ImageDataSource('weather-icon',
-                                                frequency=ICON_CACHE_TIMEOUT,
-                                                extension=ICON_EXTENSION,
-                                                user_agent=self.user_agent,
-                                                dimensions=(viewport.inner_rect.width,
-                                                            viewport.inner_rect.height))
-        event_producers_registry.register('timer', self.do_update, POLL_FREQUENCY)
-        self.do_update()
+        if self.weather_format == ICON_FORMAT:
+            return {'icon'}
+        return {field for code, field in FORMAT_FIELDS.items() if code in self.weather_format}
 
-    @property
-    def noaa_params(self) -> NOAAParams:
+    def on_weather_change(self, model: WeatherModel):
         """
-        NOAA location parameters property.
-
-        Retrieved and cached on first use.
+        Called initially and when a rendered observation field changes.
 
-        :return: NOAA parameters
+        :param model: weather model
         """
-        if self._noaa_params is None:
-            # Need grid points data in order to get local stations.
-            points_data = self.points_data_source.download(latitude=self.latitude,
-                                                           longitude=self.longitude)
-            if points_data is None:
-                raise WeatherError('NOAA geo data is unavailable')
-            wfo = points_data['properties']['gridId']
-            x = points_data['properties']['gridX']
-            y = points_data['properties']['gridY']
-            # Get local stations.
-            stations_data = self.stations_data_source.download(wfo=wfo, x=x, y=y)
-            # noinspection PyBroadException
-            try:
-                stations = [url.split('/')[-1] for url in stations_data['observationStations']]
-            except Exception as exc:
-                raise WeatherError(f'Bad or unexpected NOAA "observationStations" data: {exc}')
-            if not stations:
-                raise WeatherError('No weather stations found.')
-            self._noaa_params = NOAAParams(wfo, x, y, stations[0])
-        return self._noaa_params
+        self.icon_key = self.icon_tile = None
+        if self.weather_format == ICON_FORMAT:
+            icon = model.get_field('icon')
+            if icon:
+                self.text = None
+                self.icon_key = get_icon_key(icon)
+                if self.icon_key:
+                    self.icon_tile = self.icons.get_tile(self.icon_key)
+                else:
+                    log.error(f'Unrecognized NOAA icon URL: {icon}')
+            else:
+                self.text = '--'
+        else:
+            self.text = format_observations(model, self.weather_format, self.metric)
+        self.ready = True
 
-    def get_latest_observations(self) -> NOAAObservations:
+    def on_initialize(self, event_producers_registry: EventProducersRegistry, viewport: Viewport):
         """
-        Download latest weather observations.
+        Register handled events.
 
-        :return: observations data
+        :param event_producers_registry: event manager
+        :param viewport: display viewport
         """
-        observations_data = self.observations_data_source.download(
-            station=self.noaa_params.station)
-        if observations_data is None:
-            raise WeatherError('NOAA returned no observations data')
-        if not isinstance(observations_data, dict):
-            raise WeatherError('Badly format NOAA observations data')
-        if 'properties' not in observations_data:
-            raise WeatherError('NOAA observations data missing properties')
-        properties = observations_data['properties']
-        # Be careful to protect against unexpected data types, values, or structure.
-        timestamp = properties.get('timestamp')
-        if not timestamp or not isinstance(timestamp, str):
-            timestamp = '--'
-        description = properties.get('textDescription')
-        if not description or not isinstance(description, str):
-            description = '--'
-        temperature = '--'
-        temperature_data = properties.get('temperature')
-        if not temperature_data or not isinstance(description, dict):
-            temperature_value = temperature_data.get('value')
-            if temperature_value and isinstance(temperature_value, (int, float)):
-                if temperature_data.get('unitCode') == 'unit:degC':
-                    if not self.metric:
-                        temperature = f'{int(temperature_value * 1.8 + 32)}\u00b0'
-                else:
-                    if self.metric:
-                        temperature = f'{int((temperature_value - 32) / 1.8)}\u00b0'
-        icon = properties.get('icon')
-        return NOAAObservations(timestamp, description, temperature, icon)
+        # Panels for the same location share a model that polls and parses once.
+        self.model = WeatherModel.get(self.latitude, self.longitude, self.base_url, self.user_agent)
+        if self.weather_format == ICON_FORMAT:
+            self.icons = WeatherIcons.get(self.base_url,
+                                          self.user_agent,
+                                          (viewport.inner_rect.width, viewport.inner_rect.height))
+            self.icons.start_prefetch()
+        self.model.start(event_producers_registry)
+        self.model.subscribe(self.get_fields(), self.on_weather_change)
 
     def on_display(self, viewport: Viewport):
         """
@@ -288,9 +177,9 @@ class WeatherPanel(Panel):
 
         :param viewport: viewport for display
         """
-        if self.icon_url:
-            if self.icon_path:
-                viewport.image(self.icon_path)
+        if self.icon_key:
+            if self.icon_tile:
+                viewport.image(self.icons.atlas.get_image_data(), source_rect=self.icon_tile)
             else:
                 viewport.text('(no icon)')
         else:
@@ -303,4 +192,9 @@ class WeatherPanel(Panel):
 
         :return: True if data is ready
         """
+        if self.icon_key and self.icon_tile is None:
+            # Retry icons that were unavailable, e.g. due to a network error.
+            self.icon_tile = self.icons.get_tile(self.icon_key)
+            if self.icon_tile is not None:
+                self.ready = True
         return self.ready
@@ -0,0 +1,189 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""NOAA weather condition icons, kept in pre-resized image atlases."""
+
+import re
+import threading
+from time import sleep, time
+from typing import Dict, Optional, Tuple
+
+from rpiclock.utility import DataSource, DataSourceRegistry, ImageData, ImageDataSource, Rect, log
+from rpiclock.utility.image_atlas import ImageAtlas
+
+ICON_SOURCE_NAME = 'weather-icon'
+# Background icon fetches yield to data source requests, which share the
+# per-host rate limit, by starting late and leaving gaps between requests.
+ICON_PREFETCH_DELAY = 60
+ICON_PREFETCH_INTERVAL = 5
+# Failed on-demand downloads are retried with exponential backoff.
+ICON_RETRY_INTERVAL = 10
+ICON_RETRY_INTERVAL_MAX = 600
+# NOAA medium icons are 86x86 pixels, and large icons are 134x134 pixels.
+ICON_MEDIUM_MAX_SIZE = 86
+
+# E.g. ".../icons/land/day/tsra_hi,40/rain_showers,30?size=medium".
+ICON_URL_REGEX = re.compile(r'/icons/(land|marine)/(day|night)/([^?#]+)')
+ICON_PROBABILITY_REGEX = re.compile(r',\d*$')
+
+# Condition codes documented by the NOAA API /icons endpoint.
+KNOWN_CONDITIONS = [
+    'skc', 'few', 'sct', 'bkn', 'ovc',
+    'wind_skc', 'wind_few', 'wind_sct', 'wind_bkn', 'wind_ovc',
+    'snow', 'rain_snow', 'rain_sleet', 'snow_sleet', 'fzra', 'rain_fzra', 'snow_fzra', 'sleet',
+    'rain', 'rain_showers', 'rain_showers_hi', 'tsra', 'tsra_sct', 'tsra_hi',
+    'tornado', 'hurricane', 'tropical_storm',
+    'dust', 'smoke', 'haze', 'hot', 'cold', 'blizzard', 'fog',
+]
+KNOWN_ICON_KEYS = [f'land/{time_of_day}/{condition}'
+                   for time_of_day in ('day', 'night')
+                   for condition in KNOWN_CONDITIONS]
+
+
+def get_icon_key(url: str) -> Optional[str]:
+    """
+    Normalize a NOAA icon URL to its condition key, e.g. "land/day/rain".
+
+    Query parameters and precipitation probabilities are dropped, so that all
+    URLs for the same conditions share one icon.
+
+    :param url: icon URL
+    :return: icon key or None if the URL is not recognized
+    """
+    icon_match = ICON_URL_REGEX.search(url)
+    if icon_match is None:
+        return None
+    conditions = [ICON_PROBABILITY_REGEX.sub('', condition)
+                  for condition in icon_match.group(3).split('/') if condition]
+    if not conditions:
+        return None
+    return '/'.join([icon_match.group(1), icon_match.group(2)] + conditions)
+
+
+class WeatherIcons:
+    """
+    Condition icons for one display size, shared by all weather panels.
+
+    All known condition icons are fetched slowly in the background and added
+    to a single atlas, so that condition changes rarely require a download or
+    a resize. Icons that are needed before then, or for unknown condition
+    combinations, are fetched on demand. Failed on-demand downloads are
+    retried with exponential backoff, so that panels can keep asking.
+
+    Downloads are decoded and resized by an image data source. They are not
+    cached individually, because the atlas is their cache.
+    """
+
+    instances: Dict[Tuple[str, str, Tuple[int, int]], 'WeatherIcons'] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, base_url: str, user_agent: str, dimensions: Tuple[int, int]) -> 'WeatherIcons':
+        """
+        Get or create shared weather icons for a display size.
+
+        :param base_url: NOAA API base URL
+        :param user_agent: user agent string for NOAA API identification
+        :param dimensions: (width, height) icon dimensions
+        :return: shared weather icons instance
+        """
+        key = (base_url, user_agent, dimensions)
+        with cls._lock:
+            icons = cls.instances.get(key)
+            if icons is None:
+                icons = cls(base_url, user_agent, dimensions)
+                cls.instances[key] = icons
+            return icons
+
+    def __init__(self, base_url: str, user_agent: str, dimensions: Tuple[int, int]):
+        """
+        Weather icons constructor.
+
+        Use get() to share icons.
+
+        :param base_url: NOAA API base URL
+        :param user_agent: user agent string for NOAA API identification
+        :param dimensions: (width, height) icon dimensions
+        """
+        self.base_url = base_url
+        self.size = 'medium' if max(dimensions) <= ICON_MEDIUM_MAX_SIZE else 'large'
+        # No URL here, because download request provides entire URL.
+        self.data_source = DataSourceRegistry.get(ImageDataSource,
+                                                  ICON_SOURCE_NAME,
+                                                  dimensions=dimensions,
+                                                  user_agent=user_agent)
+        self.atlas = ImageAtlas(DataSource.cache_store,
+                                f'weather-icons-{dimensions[0]}x{dimensions[1]}.png',
+                                dimensions)
+        self._prefetch_thread: Optional[threading.Thread] = None
+        # (retry time, failure count) pairs for failed on-demand downloads.
+        self._retries: Dict[str, Tuple[float, int]] = {}
+
+    def get_tile(self, key: str) -> Optional[Rect]:
+        """
+        Get an icon's source rectangle in the atlas file, downloading it if needed.
+
+        Returns None without downloading while a failed download is waiting to
+        be retried, so that it is cheap to call repeatedly.
+
+        :param key: icon key from get_icon_key()
+        :return: source rectangle or None if the icon is unavailable
+        """
+        tile = self.atlas.get_tile(key)
+        if tile is None:
+            retry_time, failures = self._retries.get(key, (0, 0))
+            if time() < retry_time:
+                return None
+            data = self._download(key)
+            if data is not None and self.atlas.add({key: data}):
+                tile = self.atlas.get_tile(key)
+            if tile is None:
+                retry_interval = min(ICON_RETRY_INTERVAL * 2 ** failures, ICON_RETRY_INTERVAL_MAX)
+                self._retries[key] = (time() + retry_interval, failures + 1)
+                return None
+        self._retries.pop(key, None)
+        return tile
+
+    def start_prefetch(self):
+        """Fetch missing known condition icons in a background thread, once."""
+        with self._lock:
+            if self._prefetch_thread is not None:
+                return
+            self._prefetch_thread = threading.Thread(target=self._prefetch,
+                                                     name='weather-icons',
+                                                     daemon=True)
+            self._prefetch_thread.start()
+
+    def _prefetch(self):
+        sleep(ICON_PREFETCH_DELAY)
+        missing_keys = self.atlas.get_missing_keys(KNOWN_ICON_KEYS)
+        if not missing_keys:
+            return
+        log.info(f'Fetch {len(missing_keys)} weather icons for "{self.atlas.path}".')
+        images: Dict[str, ImageData] = {}
+        for key in missing_keys:
+            # Icons fetched on demand in the meantime are already in the atlas.
+            if not self.atlas.get_missing_keys([key]):
+                continue
+            data = self._download(key)
+            if data is not None:
+                images[key] = data
+            sleep(ICON_PREFETCH_INTERVAL)
+        self.atlas.add(images)
+
+    def _download(self, key: str) -> Optional[ImageData]:
+        return self.data_source.download(f'{self.base_url}/icons/{key}?size={self.size}')
@@ -0,0 +1,420 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Shared NOAA weather data model for each location."""
+
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from dataclasses import dataclass
+from time import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from rpiclock.events import EventProducersRegistry
+from rpiclock.utility import DataSource, JSONDataSource, DataSourceRegistry, log
+
+from .noaa_records import (GridPoint, Observation, Station, decode_grid_point,
+                           decode_observation, decode_stations)
+
+# It's okay to poll more often, because the data source is cached.
+POLL_FREQUENCY = 60
+BASE_URL = 'https://api.weather.gov'
+
+# Points are never automatically refreshed.
+POINTS_SOURCE_NAME = 'weather-points'
+POINTS_CACHE_TIMEOUT = 0        # 0 == use forever
+POINTS_SUB_URL = '/points/{latitude:.4f},{longitude:.4f}'
+POINTS_SCHEMA = {
+    'properties': {
+        'gridId': str,
+        'gridX': int,
+        'gridY': int
+    }
+}
+POINTS_PROJECTION = [
+    'properties.gridId',
+    'properties.gridX',
+    'properties.gridY',
+]
+
+STATIONS_SOURCE_NAME = 'weather-stations'
+STATIONS_CACHE_TIMEOUT = 900    # refresh every 15 minutes
+STATIONS_SUB_URL = '/gridpoints/{wfo}/{x},{y}/stations'
+STATIONS_SCHEMA = {
+    'observationStations': [str]
+}
+STATIONS_PROJECTION = [
+    'observationStations',
+]
+
+OBSERVATIONS_SOURCE_NAME = 'weather-observations'
+OBSERVATIONS_CACHE_TIMEOUT = 900    # refresh every 15 minutes
+OBSERVATIONS_SUB_URL = '/stations/{station}/observations/latest'
+OBSERVATIONS_SCHEMA = {
+    'properties': {
+        'timestamp': str,
+        'textDescription': str,
+        'temperature': {
+            'value': float,
+            'unitCode': str,
+        },
+        'icon': str,
+    }
+}
+# Observations are fetched concurrently from several of the nearest stations.
+OBSERVATIONS_STATION_COUNT = 3
+OBSERVATIONS_DEADLINE = 10      # seconds to wait for station observations
+OBSERVATIONS_MAX_AGE = 7200     # older observations count as station failures
+# Stations that keep failing are skipped for a while.
+STATION_FAILURE_LIMIT = 2
+STATION_RETRY_INTERVAL = 3600
+OBSERVATIONS_PROJECTION = [
+    'properties.timestamp',
+    'properties.textDescription',
+    'properties.temperature.value',
+    'properties.temperature.unitCode',
+    'properties.icon',
+]
+
+# Observation fields that views may subscribe to.
+WEATHER_FIELDS = ('timestamp', 'description', 'temperature', 'icon')
+
+
+@dataclass
+class NOAAParams:
+    """NOAA parameters for identifying weather source."""
+    grid_point: GridPoint
+    stations: Tuple[Station, ...]
+
+
+@dataclass
+class StationHealth:
+    """Observation station reliability tracking."""
+    failures: int = 0
+    """Consecutive failures."""
+    skip_until: float = 0
+    """Time until which the station is skipped."""
+
+
+@dataclass
+class WeatherSubscription:
+    """View subscription to weather model fields."""
+    fields: FrozenSet[str]
+    """Observation field names that trigger the call-back."""
+    callback_ref: weakref.WeakMethod
+    """Weak reference to the bound call-back method, so that views may be discarded."""
+
+
+class WeatherError(Exception):
+    """Weather retrieval exception used internally."""
+    pass
+
+
+class WeatherModel:
+    """
+    Latest weather observations for one location, shared by all weather panels.
+
+    Observations are polled and parsed once for the location, and subscribed
+    views are notified when fields they render change.
+
+    Polls run on the shared data source event loop thread, so that the main
+    loop never waits for the network. Results are applied, and views are
+    notified, by a tick handler on the main loop thread.
+    """
+
+    instances: Dict[Tuple[float, float, str, str], 'WeatherModel'] = {}
+    _lock = threading.Lock()
+
+    # Station health by station ID, shared by all locations.
+    station_health: Dict[str, StationHealth] = {}
+
+    @classmethod
+    def get(cls,
+            latitude: float,
+            longitude: float,
+            base_url: str,
+            user_agent: str,
+            ) -> 'WeatherModel':
+        """
+        Get or create the shared weather model for a location.
+
+        :param latitude: weather location latitude
+        :param longitude: weather location longitude
+        :param base_url: NOAA API base URL
+        :param user_agent: user agent string for NOAA API identification
+        :return: shared weather model
+        """
+        key = (latitude, longitude, base_url, user_agent)
+        with cls._lock:
+            model = cls.instances.get(key)
+            if model is None:
+                model = cls(latitude, longitude, base_url, user_agent)
+                cls.instances[key] = model
+            return model
+
+    def __init__(self, latitude: float, longitude: float, base_url: str, user_agent: str):
+        """
+        Weather model constructor.
+
+        Use get() to share models.
+
+        :param latitude: weather location latitude
+        :param longitude: weather location longitude
+        :param base_url: NOAA API base URL
+        :param user_agent: user agent string for NOAA API identification
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        # Shared data sources allow models for nearby locations to coalesce requests.
+        self.points_data_source = DataSourceRegistry.get(JSONDataSource,
+                                                         POINTS_SOURCE_NAME,
+                                                         base_url,
+                                                         POINTS_SUB_URL,
+                                                         frequency=POINTS_CACHE_TIMEOUT,
+                                                         schema=POINTS_SCHEMA,
+                                                         projection=POINTS_PROJECTION,
+                                                         decoder=decode_grid_point,
+                                                         user_agent=user_agent)
+        self.stations_data_source = DataSourceRegistry.get(JSONDataSource,
+                                                           STATIONS_SOURCE_NAME,
+                                                           base_url,
+                                                           STATIONS_SUB_URL,
+                                                           frequency=STATIONS_CACHE_TIMEOUT,
+                                                           schema=STATIONS_SCHEMA,
+                                                           projection=STATIONS_PROJECTION,
+                                                           decoder=decode_stations,
+                                                           user_agent=user_agent)
+        self.observations_data_source = DataSourceRegistry.get(JSONDataSource,
+                                                               OBSERVATIONS_SOURCE_NAME,
+                                                               base_url,
+                                                               OBSERVATIONS_SUB_URL,
+                                                               frequency=OBSERVATIONS_CACHE_TIMEOUT,
+                                                               projection=OBSERVATIONS_PROJECTION,
+                                                               decoder=decode_observation,
+                                                               user_agent=user_agent)
+        self.observations: Optional[Observation] = None
+        self._noaa_params: Optional[NOAAParams] = None
+        self._subscriptions: List[WeatherSubscription] = []
+        self._started = False
+        # In-progress poll on the event loop thread.
+        self._update_future: Optional[Future] = None
+
+    def start(self, event_producers_registry: EventProducersRegistry):
+        """
+        Start polling, once, and start the initial update.
+
+        The poll timer and the tick handler that applies poll results are
+        permanent, because models outlive screens and panels. Polling is
+        skipped while no views are subscribed. The poll interval has
+        per-device jitter, like the cache lifetimes.
+
+        :param event_producers_registry: event manager
+        """
+        if self._started:
+            return
+        self._started = True
+        event_producers_registry.register('timer',
+                                          self.on_timer,
+                                          DataSource.jitter.apply(POLL_FREQUENCY, OBSERVATIONS_SOURCE_NAME),
+                                          permanent=True)
+        event_producers_registry.register('tick', self.on_tick, permanent=True)
+        self.update()
+
+    def subscribe(self, fields: Iterable[str], callback: Callable[['WeatherModel'], None]):
+        """
+        Subscribe a view to observation field changes.
+
+        The call-back must be a bound method. It is called immediately with
+        the current state, and then whenever a subscribed field changes. The
+        subscription ends when the view object is garbage collected.
+
+        :param fields: observation field names from WEATHER_FIELDS
+        :param callback: bound method that receives the model
+        """
+        self._subscriptions.append(WeatherSubscription(frozenset(fields), weakref.WeakMethod(callback)))
+        callback(self)
+
+    def get_field(self, field: str) -> Any:
+        """
+        Get an observation field value.
+
+        :param field: observation field name from WEATHER_FIELDS
+        :return: field value or None if observations are unavailable
+        """
+        if self.observations is None:
+            return None
+        return getattr(self.observations, field)
+
+    def on_timer(self):
+        """Periodic poll timer handler."""
+        self._subscriptions = [subscription for subscription in self._subscriptions
+                               if subscription.callback_ref() is not None]
+        if self._subscriptions:
+            self.update()
+
+    def on_tick(self):
+        """Main loop tick handler that applies a completed poll."""
+        if self._update_future is not None and self._update_future.done():
+            future = self._update_future
+            self._update_future = None
+            self._apply_update(future)
+
+    def update(self):
+        """
+        Start retrieving the latest observations in the background.
+
+        Views are notified of changed fields by on_tick() once it completes.
+        Does nothing while a previous update is in progress.
+        """
+        if self._update_future is None:
+            self._update_future = DataSource.event_loop.submit(self.get_latest_observations())
+
+    def _apply_update(self, future: Future):
+        old_values = {field: self.get_field(field) for field in WEATHER_FIELDS}
+        # noinspection PyBroadException
+        try:
+            self.observations = future.result()
+        except WeatherError as exc:
+            self.observations = None
+            log.error(f'Weather retrieval error: {str(exc)}')
+        except Exception as exc:
+            self.observations = None
+            log.error(f'Weather update failed: {exc}')
+        changed_fields = {field for field in WEATHER_FIELDS if self.get_field(field) != old_values[field]}
+        if not changed_fields:
+            return
+        for subscription in self._subscriptions:
+            if subscription.fields & changed_fields:
+                callback = subscription.callback_ref()
+                if callback is not None:
+                    callback(self)
+
+    @property
+    def noaa_params(self) -> NOAAParams:
+        """
+        NOAA location parameters property.
+
+        Retrieved and cached on first use. Downloads on the caller's thread.
+
+        :return: NOAA parameters
+        """
+        if self._noaa_params is None:
+            # Need grid points data in order to get local stations.
+            grid_point: Optional[GridPoint] = self.points_data_source.download(
+                latitude=self.latitude, longitude=self.longitude)
+            if grid_point is None:
+                raise WeatherError('NOAA geo data is unavailable')
+            # Get local stations.
+            stations: Optional[Tuple[Station, ...]] = self.stations_data_source.download(
+                wfo=grid_point.wfo, x=grid_point.x, y=grid_point.y)
+            if stations is None:
+                raise WeatherError('NOAA "observationStations" data is unavailable')
+            if not stations:
+                raise WeatherError('No weather stations found.')
+            self._noaa_params = NOAAParams(grid_point, stations)
+        return self._noaa_params
+
+    async def get_latest_observations(self) -> Observation:
+        """
+        Download latest weather observations.
+
+        Runs on the data source event loop, and looks up the NOAA parameters
+        in an executor thread the first time.
+
+        Observations are fetched concurrently from the nearest healthy
+        stations, with a deadline, and the freshest complete observation wins.
+
+        Only network or HTTP failures, missed deadlines, and incomplete or
+        old observations count against station health. Requests skipped
+        locally, e.g. while offline or rate limited, don't.
+
+        :return: observation record
+        """
+        if self._noaa_params is None:
+            # Blocking downloads, normally only once.
+            await asyncio.get_event_loop().run_in_executor(None, lambda: self.noaa_params)
+        station_ids = self._choose_station_ids()
+        observations_by_station, failed_station_ids = await self._fetch_observations(station_ids)
+        best_observation: Optional[Observation] = None
+        now = time()
+        for station_id in station_ids:
+            observation = observations_by_station.get(station_id)
+            if observation is not None:
+                self._update_station_health(station_id,
+                                            observation.complete
+                                            and now - observation.time <= OBSERVATIONS_MAX_AGE)
+            elif station_id in failed_station_ids:
+                self._update_station_health(station_id, False)
+            if observation is not None and (best_observation is None
+                                            or (observation.complete, observation.time)
+                                            > (best_observation.complete, best_observation.time)):
+                best_observation = observation
+        if best_observation is None:
+            raise WeatherError('NOAA returned no observations data')
+        return best_observation
+
+    def _choose_station_ids(self) -> List[str]:
+        # Nearest stations first, skipping unhealthy ones, unless all are unhealthy.
+        station_ids = [station.station_id for station in self.noaa_params.stations]
+        now = time()
+        healthy_station_ids = [station_id for station_id in station_ids
+                               if self.station_health.get(station_id, StationHealth()).skip_until <= now]
+        return (healthy_station_ids or station_ids)[:OBSERVATIONS_STATION_COUNT]
+
+    def _update_station_health(self, station_id: str, is_healthy: bool):
+        health = self.station_health.setdefault(station_id, StationHealth())
+        if is_healthy:
+            health.failures = 0
+            return
+        health.failures += 1
+        if health.failures >= STATION_FAILURE_LIMIT:
+            log.error(f'Skip failing weather station {station_id} for {STATION_RETRY_INTERVAL} seconds.')
+            health.failures = 0
+            health.skip_until = time() + STATION_RETRY_INTERVAL
+
+    async def _fetch_observations(self,
+                                  station_ids: List[str],
+                                  ) -> Tuple[Dict[str, Observation], Set[str]]:
+        # Returns observations and failed station IDs. Fetches that miss the
+        # deadline are cancelled.
+        start_time = time()
+        tasks = {station_id: asyncio.ensure_future(self.observations_data_source.fetch(station=station_id))
+                 for station_id in station_ids}
+        done, pending = await asyncio.wait(list(tasks.values()), timeout=OBSERVATIONS_DEADLINE)
+        for task in pending:
+            task.cancel()
+        observations_by_station: Dict[str, Observation] = {}
+        failed_station_ids: Set[str] = set()
+        for station_id, task in tasks.items():
+            if task not in done:
+                log.error(f'Weather station {station_id} missed the observations deadline.')
+                failed_station_ids.add(station_id)
+            elif task.exception() is not None:
+                log.error(f'Weather station {station_id} observations error: {task.exception()}')
+                failed_station_ids.add(station_id)
+            elif task.result() is None:
+                url = self.observations_data_source.resolve_url(station=station_id)
+                failure_time = self.observations_data_source.get_failure_time(url)
+                if failure_time is not None and failure_time >= start_time:
+                    log.error(f'Weather station {station_id} returned no observations data.')
+                    failed_station_ids.add(station_id)
+                else:
+                    log.warning(f'Weather station {station_id} observations were skipped.')
+            else:
+                observations_by_station[station_id] = task.result()
+        return observations_by_station, failed_station_ids
@@ -18,11 +18,11 @@
 """Viewport support for screen display regions."""
 
 import os
-from typing import Optional, List
+from typing import Optional, List, Union
 
 from rpiclock.drivers import Display
 from rpiclock.events import EventProducersRegistry
-from rpiclock.utility import log, Rect, Font
+from rpiclock.utility import log, Rect, Font, ImageData
 from rpiclock.utility.typing import Color, FontSize, Position, Interval, Margins
 
 from .constants import COLOR_DEFAULT_FOREGROUND, COLOR_DEFAULT_BACKGROUND, COLOR_DEFAULT_BORDER
@@ -163,26 +163,32 @@ class Viewport:
             self.event_producers_registry.register('timer', self.clear, duration, max_count=1)
 
     def image(self,
-              path: str,
+              image: Union[str, ImageData],
               duration: Interval = None,
-              overwrite: bool = False):
+              overwrite: bool = False,
+              source_rect: Rect = None):
         """
-        Display image file in viewport.
+        Display image file or decoded image data in viewport.
 
-        :param path: image file path
+        :param image: image file path or decoded image data
         :param duration: optional duration before clearing
         :param overwrite: optional boolean to disable clearing the viewport
+        :param source_rect: optional part of the image to display, e.g. an atlas tile
         """
         if self.rect is None:
             return
-        if not path or not os.path.isfile(path):
-            log.error(f'Image file is missing: {path}')
+        is_image_data = isinstance(image, ImageData)
+        if not is_image_data and (not image or not os.path.isfile(image)):
+            log.error(f'Image file is missing: {image}')
             self.text('*missing*', duration=duration, overwrite=overwrite)
             return
         if not overwrite:
             self.clear()
         image_rect = self.rect.sub_rect(fleft=self.fx, ftop=self.fy, margins=self.margins)
-        self.display.render_image(path, image_rect)
+        if is_image_data:
+            self.display.render_image_data(image, image_rect, source_rect=source_rect)
+        else:
+            self.display.render_image(image, image_rect, source_rect=source_rect)
         if duration is not None:
             self.event_producers_registry.register('timer', self.clear, duration, max_count=1)
 
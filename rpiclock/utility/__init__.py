@@ -21,8 +21,10 @@ from dataclasses import dataclass
 
 from .color_resolver import ColorResolver, NAMED_COLORS
 from .config import Config, ConfigDict
-from .data_source import DataSource, JSONDataSource, ImageDataSource
+from .data_source import DataSource, JSONDataSource, FileDataSource, ImageDataSource
+from .data_source_registry import DataSourceRegistry
 from .fonts_finder import FontsFinder, FONT_DEFAULT_NAME, FONT_DEFAULT_SIZE
+from .image_data import ImageData
 from .logger import log
 from .rect import Rect
 from .timer import Timer
@@ -0,0 +1,354 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Minimal asynchronous HTTP/1.1 client based on asyncio streams."""
+
+import asyncio
+import ssl
+import threading
+from dataclasses import dataclass
+from email.message import Message
+from email.parser import BytesHeaderParser
+from time import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from .connection_pool import (ContentDecoder, DEFAULT_IDLE_TIMEOUT, DEFAULT_MAX_IDLE_PER_HOST,
+                              DEFAULT_TIMEOUT, HostKey, MAX_REDIRECTS, READ_CHUNK_SIZE,
+                              REDIRECT_STATUSES)
+from .dns_cache import DNSCache
+from .logger import log
+from .typing import Interval
+
+# Body-less response statuses.
+NO_BODY_STATUSES = (204, 304)
+
+# Exceptions that indicate a reused connection was dropped by the server.
+STALE_CONNECTION_EXCEPTIONS = (ConnectionError, asyncio.IncompleteReadError)
+
+_ssl_context: Optional[ssl.SSLContext] = None
+
+
+@dataclass
+class AsyncResponse:
+    """Complete HTTP response."""
+    status: int
+    """HTTP status code."""
+    reason: str
+    """HTTP status reason."""
+    headers: Message
+    """Response headers."""
+    body: bytearray
+    """Decoded response body."""
+    bytes_read: int
+    """Response body bytes received, before decoding."""
+
+
+@dataclass
+class AsyncIdleConnection:
+    """Idle asynchronous connection waiting to be reused."""
+    reader: asyncio.StreamReader
+    """Connection stream reader."""
+    writer: asyncio.StreamWriter
+    """Connection stream writer."""
+    loop: asyncio.AbstractEventLoop
+    """Event loop that owns the connection streams."""
+    idle_time: float
+    """Time when the connection became idle."""
+
+
+class AsyncConnectionPool:
+    """
+    Pool of persistent asynchronous HTTP/HTTPS connections, shared across hosts.
+
+    The asynchronous counterpart of ConnectionPool. Idle connections are kept
+    per scheme/host/port, expire after an idle timeout, and are transparently
+    replaced when the server has dropped them. Connections belong to the event
+    loop that opened them, and are only reused by requests on the same loop.
+    """
+
+    def __init__(self,
+                 idle_timeout: Interval = DEFAULT_IDLE_TIMEOUT,
+                 max_idle_per_host: int = DEFAULT_MAX_IDLE_PER_HOST,
+                 dns_cache: DNSCache = None):
+        """
+        Asynchronous connection pool constructor.
+
+        :param idle_timeout: seconds before an idle connection is discarded
+        :param max_idle_per_host: maximum idle connections kept per host, 0 to disable reuse
+        :param dns_cache: optional DNS cache for resolving host names
+        """
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.dns_cache = dns_cache
+        self._idle: Dict[HostKey, List[AsyncIdleConnection]] = {}
+        self._lock = threading.Lock()
+
+    async def request(self,
+                      url: str,
+                      headers: Dict[str, str] = None,
+                      method: str = 'GET',
+                      timeout: Interval = DEFAULT_TIMEOUT,
+                      ) -> AsyncResponse:
+        """
+        Send a request, following redirects, and read the whole response.
+
+        The connection is returned to the pool when the response is complete
+        and the server allows it. Otherwise, or when the calling task is
+        cancelled, the connection is closed.
+
+        :param url: request URL
+        :param headers: request headers
+        :param method: request method
+        :param timeout: timeout in seconds for each request, including redirects
+        :return: response with the decoded body
+        :raise: asyncio.TimeoutError, OSError, ssl.SSLError, or ValueError
+        """
+        for _redirect in range(MAX_REDIRECTS + 1):
+            response = await asyncio.wait_for(self._request_once(url, headers or {}, method), timeout)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+        raise ValueError(f'Too many redirects for "{url}".')
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle_connections = [idle_connection
+                                for host_idle_connections in self._idle.values()
+                                for idle_connection in host_idle_connections]
+            self._idle = {}
+        for idle_connection in idle_connections:
+            _close_writer(idle_connection.writer, idle_connection.loop)
+
+    async def _request_once(self, url: str, headers: Dict[str, str], method: str) -> AsyncResponse:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme "{parts.scheme}".')
+        is_https = parts.scheme == 'https'
+        key: HostKey = (parts.scheme, parts.hostname, parts.port or (443 if is_https else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += f'?{parts.query}'
+        request_headers = {'Host': parts.netloc}
+        request_headers.update(headers)
+        connection = self._acquire(key)
+        if connection is not None:
+            try:
+                return await self._exchange(key, connection[0], connection[1], method, path, request_headers)
+            except STALE_CONNECTION_EXCEPTIONS as exc:
+                # The server closed the idle connection. Reconnect and try again.
+                log.debug(f'Reconnect to {key[1]}:{key[2]} after error: {exc}')
+        reader, writer = await _open_connection(key[1], key[2], is_https, self.dns_cache)
+        return await self._exchange(key, reader, writer, method, path, request_headers)
+
+    async def _exchange(self,
+                        key: HostKey,
+                        reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter,
+                        method: str,
+                        path: str,
+                        headers: Dict[str, str],
+                        ) -> AsyncResponse:
+        # Closes the connection, including when cancelled, unless it is reusable.
+        reusable = False
+        try:
+            response, reusable = await _send(reader, writer, method, path, headers)
+            return response
+        finally:
+            if reusable:
+                self._release(key, reader, writer)
+            else:
+                writer.close()
+
+    def _acquire(self, key: HostKey) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        loop = asyncio.get_event_loop()
+        stale_connections: List[AsyncIdleConnection] = []
+        connection: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        with self._lock:
+            idle_connections = self._idle.get(key, [])
+            while idle_connections:
+                idle_connection = idle_connections.pop()
+                if (idle_connection.loop is loop
+                        and time() - idle_connection.idle_time < self.idle_timeout
+                        and not idle_connection.reader.at_eof()):
+                    connection = (idle_connection.reader, idle_connection.writer)
+                    break
+                stale_connections.append(idle_connection)
+        for idle_connection in stale_connections:
+            _close_writer(idle_connection.writer, idle_connection.loop)
+        return connection
+
+    def _release(self, key: HostKey, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        with self._lock:
+            idle_connections = self._idle.setdefault(key, [])
+            if len(idle_connections) < self.max_idle_per_host:
+                idle_connections.append(AsyncIdleConnection(reader, writer, asyncio.get_event_loop(), time()))
+                return
+        writer.close()
+
+
+async def async_request(url: str,
+                        headers: Dict[str, str] = None,
+                        method: str = 'GET',
+                        timeout: Interval = DEFAULT_TIMEOUT,
+                        dns_cache: DNSCache = None,
+                        ) -> AsyncResponse:
+    """
+    Send a request, following redirects, and read the whole response.
+
+    Each request uses a new connection, which is closed when the response is
+    complete or when the calling task is cancelled. Use AsyncConnectionPool
+    to reuse connections.
+
+    :param url: request URL
+    :param headers: request headers
+    :param method: request method
+    :param timeout: timeout in seconds for each request, including redirects
+    :param dns_cache: optional DNS cache for resolving host names
+    :return: response with the decoded body
+    :raise: asyncio.TimeoutError, OSError, ssl.SSLError, or ValueError
+    """
+    pool = AsyncConnectionPool(max_idle_per_host=0, dns_cache=dns_cache)
+    return await pool.request(url, headers, method=method, timeout=timeout)
+
+
+def _close_writer(writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+    # Streams must be closed by their own event loop, which may have stopped.
+    if loop.is_closed():
+        return
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        writer.close()
+    else:
+        loop.call_soon_threadsafe(writer.close)
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    # Loading the default certificates is expensive, so share the context.
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+async def _open_connection(host: str,
+                           port: int,
+                           is_https: bool,
+                           dns_cache: Optional[DNSCache],
+                           ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    ssl_context = _get_ssl_context() if is_https else None
+    server_hostname = host if is_https else None
+    if dns_cache is None:
+        return await asyncio.open_connection(host, port, ssl=ssl_context, server_hostname=server_hostname)
+    # Blocking lookups, i.e. for hosts that aren't cached, run in a worker thread.
+    addresses = dns_cache.get_cached(host, port)
+    if addresses is None:
+        addresses = await asyncio.get_event_loop().run_in_executor(None, dns_cache.resolve, host, port)
+    error: Optional[OSError] = None
+    for _family, _type, _proto, _canonical_name, socket_address in addresses:
+        try:
+            # TLS server name indication and certificate checks still use the host name.
+            return await asyncio.open_connection(socket_address[0],
+                                                 socket_address[1],
+                                                 ssl=ssl_context,
+                                                 server_hostname=server_hostname)
+        except OSError as exc:
+            error = exc
+    raise error if error is not None else OSError(f'No addresses for "{host}".')
+
+
+async def _send(reader: asyncio.StreamReader,
+                writer: asyncio.StreamWriter,
+                method: str,
+                path: str,
+                headers: Dict[str, str],
+                ) -> Tuple[AsyncResponse, bool]:
+    # Returns the response and whether the connection may be reused.
+    request_lines = [f'{method} {path} HTTP/1.1']
+    request_lines.extend(f'{name}: {value}' for name, value in headers.items())
+    writer.write(('\r\n'.join(request_lines) + '\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+    status_data = await reader.readline()
+    if not status_data:
+        raise ConnectionResetError('Connection closed before the response.')
+    status_line = status_data.decode('latin-1').rstrip('\r\n')
+    version, _separator, status_text = status_line.partition(' ')
+    if not version.startswith('HTTP/'):
+        raise ValueError(f'Bad HTTP status line "{status_line}".')
+    status, _separator, reason = status_text.partition(' ')
+    header_data = bytearray()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        header_data += line
+    response_headers = BytesHeaderParser().parsebytes(bytes(header_data))
+    response = AsyncResponse(int(status), reason, response_headers, bytearray(), 0)
+    is_delimited = True
+    if method != 'HEAD' and response.status not in NO_BODY_STATUSES:
+        is_delimited = await _read_body(reader, response)
+    connection_tokens = (response_headers.get('Connection') or '').lower()
+    if version == 'HTTP/1.0':
+        keep_alive = 'keep-alive' in connection_tokens
+    else:
+        keep_alive = 'close' not in connection_tokens
+    return response, is_delimited and keep_alive
+
+
+async def _read_body(reader: asyncio.StreamReader, response: AsyncResponse) -> bool:
+    # Returns False if the body was delimited by closing the connection.
+    decoder = ContentDecoder(response.headers.get('Content-Encoding'))
+    transfer_encoding = (response.headers.get('Transfer-Encoding') or '').lower()
+    content_length = response.headers.get('Content-Length')
+    if 'chunked' in transfer_encoding:
+        while True:
+            size_line = await reader.readline()
+            chunk_size = int(size_line.split(b';', 1)[0].strip(), 16)
+            if chunk_size == 0:
+                # Skip trailers.
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunk = await reader.readexactly(chunk_size)
+            await reader.readline()
+            response.bytes_read += len(chunk)
+            response.body += decoder.decode(chunk)
+    elif content_length is not None:
+        remaining = int(content_length)
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, READ_CHUNK_SIZE))
+            if not chunk:
+                raise ValueError('Connection closed before the response body was complete.')
+            remaining -= len(chunk)
+            response.bytes_read += len(chunk)
+            response.body += decoder.decode(chunk)
+    else:
+        while True:
+            chunk = await reader.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            response.bytes_read += len(chunk)
+            response.body += decoder.decode(chunk)
+        response.body += decoder.flush()
+        return False
+    response.body += decoder.flush()
+    return True
@@ -0,0 +1,267 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+LAN cache proxy that shares one instance's data source cache with other clocks.
+
+Clocks use the proxy by setting their NOAA "base_url" panel parameter to the
+proxy URL, e.g. "http://clock1.local:8081". Requests are forwarded to the
+upstream URL through a data source, so the proxy shares the cache budget,
+rate limiting, and prefetching with any panels running in the same process.
+
+The proxy caches raw response bodies, separately from the projected data
+cached by panel data sources. A clock that hosts the proxy should also point
+its own panels at the proxy, e.g. "http://localhost:8081", so that each URL
+is fetched upstream only once.
+
+The proxy only listens on the loopback interface by default. Serving the LAN
+requires a host address, e.g. "0.0.0.0", and only paths under the upstream
+URL are forwarded.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import List, Optional, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from .cache_store import CacheMetadata
+from .data_source import DataSource, DownloadResult
+from .data_source_registry import DataSourceRegistry
+from .logger import log
+
+DEFAULT_CACHE_PROXY_PORT = 8081
+# Serving other clocks requires configuring a LAN-facing address on purpose.
+DEFAULT_CACHE_PROXY_HOST = '127.0.0.1'
+DEFAULT_CACHE_PROXY_UPSTREAM_URL = 'https://api.weather.gov'
+# Fallback lifetime for responses without Cache-Control or Expires headers.
+DEFAULT_CACHE_PROXY_TTL = 300
+# Cache-Control max-age for data that never expires, i.e. one year.
+MAX_AGE_FOREVER = 31536000
+PROXY_SOURCE_NAME = 'cache-proxy'
+# A standalone proxy process must not share a clock's cache index.
+PROXY_CACHE_SUBFOLDER_NAME = 'rpi-clock-proxy-cache'
+
+
+class RawDataSource(DataSource):
+    """Data source that returns and caches response bodies unchanged."""
+
+    # === Required overrides.
+
+    def on_process_download(self,
+                            data: Union[str, bytes],
+                            cache_path: str,
+                            ) -> DownloadResult:
+        """
+        Required override to check and massage downloaded data.
+
+        :param data: raw data
+        :param cache_path: future cache file path
+        :return: returned bundle of massaged data and cache
+        """
+        body = bytes(data)
+        return DownloadResult(body, body)
+
+    def on_generate_cache_path(self, url: str, base_path: str) -> str:
+        """
+        Required override to generate a cache path based on a URL.
+
+        :param url: source URL
+        :param base_path: base cache path
+        :return: full cache file path
+        """
+        return f'{base_path}.raw'
+
+    def on_load_cache_file(self, path: str) -> bytes:
+        """
+        Required override to load, check, and massage cached data.
+
+        :param path: cache file path
+        :return: response body
+        :raise: I/O exception
+        """
+        with open(path, 'rb') as cache_file:
+            return cache_file.read()
+
+    def on_save_cache_file(self, path: str, data: Union[str, bytes]):
+        """
+        Required override to save cache data.
+
+        :param path: cache file path
+        :param data: data to save
+        :raise: I/O exception
+        """
+        with open(path, 'wb') as cache_file:
+            cache_file.write(data)
+
+
+class CacheProxyServer(ThreadingHTTPServer):
+    """
+    HTTP server that serves upstream GET requests from the data source cache.
+
+    Responses carry the cached entry's remaining lifetime as Cache-Control
+    max-age, its ETag and Last-Modified validators, and the upstream
+    Content-Type. Conditional requests
+    that match the validators receive 304 (Not Modified) responses, so
+    clients see the same expiration and revalidation behavior as upstream.
+    Upstream failures that leave no cached data return 502 (Bad Gateway).
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int = DEFAULT_CACHE_PROXY_PORT,
+                 host: str = DEFAULT_CACHE_PROXY_HOST,
+                 upstream_url: str = DEFAULT_CACHE_PROXY_UPSTREAM_URL,
+                 ttl: int = DEFAULT_CACHE_PROXY_TTL):
+        """
+        Cache proxy server constructor.
+
+        :param port: listening port
+        :param host: listening host address, e.g. "0.0.0.0" for all (default: loopback only)
+        :param upstream_url: base URL for forwarded requests
+        :param ttl: fallback cache lifetime in seconds, when upstream doesn't specify one
+        """
+        super().__init__((host, port), CacheProxyRequestHandler)
+        self.upstream_url = upstream_url.rstrip('/')
+        self.ttl = ttl
+        self._thread: Optional[threading.Thread] = None
+
+    def get_data_source(self, user_agent: Optional[str]) -> RawDataSource:
+        """
+        Get the shared data source for a client user agent.
+
+        The client's User-Agent header is forwarded, e.g. because the NOAA
+        API uses it to identify applications.
+
+        :param user_agent: client User-Agent header value
+        :return: raw data source
+        """
+        return DataSourceRegistry.get(RawDataSource,
+                                      PROXY_SOURCE_NAME,
+                                      frequency=self.ttl,
+                                      user_agent=user_agent)
+
+    def get_upstream_url(self, path: str) -> Optional[str]:
+        """
+        Build the upstream URL for a request path.
+
+        Paths that could change the upstream host, e.g. "@host/path" or
+        "//host/path", are rejected.
+
+        :param path: request path, including any query
+        :return: upstream URL or None if the path is not allowed
+        """
+        if not path.startswith('/') or path.startswith('//'):
+            return None
+        upstream_parts = urlsplit(self.upstream_url)
+        path, _separator, query = path.partition('#')[0].partition('?')
+        url = urlunsplit((upstream_parts.scheme,
+                          upstream_parts.netloc,
+                          upstream_parts.path + path,
+                          query,
+                          ''))
+        url_parts = urlsplit(url)
+        # noinspection PyBroadException
+        try:
+            if (url_parts.hostname != upstream_parts.hostname
+                    or url_parts.port != upstream_parts.port):
+                return None
+        except Exception:
+            # Invalid port.
+            return None
+        return url
+
+    def start(self):
+        """Serve requests in a background thread."""
+        if self._thread is None:
+            log.info(f'Serve data source cache proxy for "{self.upstream_url}"'
+                     f' on {self.server_address[0]}:{self.server_address[1]}.')
+            self._thread = threading.Thread(target=self.serve_forever,
+                                            name='cache-proxy',
+                                            daemon=True)
+            self._thread.start()
+
+
+class CacheProxyRequestHandler(BaseHTTPRequestHandler):
+    """Cache proxy request handler."""
+
+    protocol_version = 'HTTP/1.1'
+    server: CacheProxyServer
+
+    # noinspection PyPep8Naming
+    def do_GET(self):
+        """Handle GET request."""
+        url = self.server.get_upstream_url(self.path)
+        if url is None:
+            self._send(400)
+            return
+        data_source = self.server.get_data_source(self.headers.get('User-Agent'))
+        # Escape braces, because the URL is treated as a template.
+        url = url.replace('{', '{{').replace('}', '}}')
+        body = data_source.download(url)
+        if body is None:
+            self._send(502)
+            return
+        metadata = data_source.cache_store.get_metadata(data_source.get_cache_path(url.format()))
+        headers = self._get_cache_headers(metadata)
+        if metadata is not None and self._is_not_modified(metadata):
+            self._send(304, headers)
+            return
+        self._send(200, headers, body)
+
+    def log_message(self, format_string: str, *args):
+        """
+        Send request logging to the common logger.
+
+        :param format_string: message format string
+        :param args: message format arguments
+        """
+        log.info(f'Cache proxy: {format_string % args}')
+
+    def _is_not_modified(self, metadata: CacheMetadata) -> bool:
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return bool(metadata.etag) and metadata.etag in [tag.strip() for tag in if_none_match.split(',')]
+        if_modified_since = self.headers.get('If-Modified-Since')
+        return bool(if_modified_since) and if_modified_since == metadata.last_modified
+
+    @staticmethod
+    def _get_cache_headers(metadata: Optional[CacheMetadata]) -> List[Tuple[str, str]]:
+        if metadata is None:
+            # Not cached, e.g. when the cache write failed.
+            return [('Cache-Control', 'no-cache')]
+        if metadata.expires is None:
+            max_age = MAX_AGE_FOREVER
+        else:
+            max_age = max(int(metadata.expires - time()), 0)
+        headers = [('Cache-Control', f'max-age={max_age}')]
+        if metadata.etag:
+            headers.append(('ETag', metadata.etag))
+        if metadata.last_modified:
+            headers.append(('Last-Modified', metadata.last_modified))
+        if metadata.content_type:
+            headers.append(('Content-Type', metadata.content_type))
+        return headers
+
+    def _send(self, status: int, headers: List[Tuple[str, str]] = None, body: bytes = b''):
+        self.send_response(status)
+        for name, value in headers or []:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
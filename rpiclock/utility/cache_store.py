@@ -0,0 +1,356 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Size-bounded file cache store with a metadata index."""
+
+import grp
+import json
+import os
+import pwd
+import tempfile
+import threading
+from dataclasses import dataclass, asdict
+from time import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .logger import log
+
+DEFAULT_CACHE_FOLDER = '/tmp'
+# Cache files are kept in a dedicated sub-folder, so that cleaning up never
+# touches unrelated files in the configured folder.
+CACHE_SUBFOLDER_NAME = 'rpi-clock-cache'
+DEFAULT_CACHE_OWNER = 'pi'
+DEFAULT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+INDEX_FILE_NAME = 'index.json'
+INDEX_VERSION = 1
+TEMPORARY_FILE_PREFIX = '.tmp-'
+
+
+@dataclass
+class CacheMetadata:
+    """Cache entry expiration, HTTP validators, and content type."""
+    expires: Optional[float]
+    """Expiration time, or None if it never expires."""
+    etag: Optional[str] = None
+    """ETag response header for If-None-Match requests."""
+    last_modified: Optional[str] = None
+    """Last-Modified response header for If-Modified-Since requests."""
+    content_type: Optional[str] = None
+    """Content-Type response header, e.g. for the cache proxy to send back."""
+
+    def is_expired(self) -> bool:
+        """
+        Check for expiration.
+
+        :return: True if the cache entry has expired
+        """
+        return self.expires is not None and time() >= self.expires
+
+    def has_validators(self) -> bool:
+        """
+        Check for validators that allow making a conditional request.
+
+        :return: True if there is an ETag or Last-Modified value
+        """
+        return bool(self.etag or self.last_modified)
+
+
+@dataclass
+class CacheIndexEntry:
+    """Cache index entry."""
+    metadata: CacheMetadata
+    """Expiration and validators."""
+    size: int
+    """File size in bytes."""
+    accessed: float
+    """Last access time for LRU eviction."""
+
+
+class CacheStore:
+    """
+    File cache folder with a byte budget and least recently used eviction.
+
+    A single index file records the size, expiration, validators, and last
+    access time of every cache file, so that reading the cache never requires
+    directory scans or file status calls. Files are written atomically.
+
+    Files live in a dedicated sub-folder of the configured folder, which the
+    store creates. Separate processes, e.g. a clock and a standalone cache
+    proxy, must use different sub-folders, because each one owns its index.
+    """
+
+    def __init__(self,
+                 folder: str = DEFAULT_CACHE_FOLDER,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 owner: Optional[str] = DEFAULT_CACHE_OWNER,
+                 on_evict: Callable[[str], None] = None,
+                 subfolder_name: str = CACHE_SUBFOLDER_NAME):
+        """
+        Cache store constructor.
+
+        The index is loaded on first use.
+
+        :param folder: parent folder path for the cache sub-folder
+        :param max_bytes: maximum total size of cache files
+        :param owner: cache folder and file owner, as "user" or "user:group", or None
+        :param on_evict: optional call-back that receives evicted file paths
+        :param subfolder_name: name of the sub-folder that holds the files and index
+        """
+        self.folder = folder
+        self.subfolder_name = subfolder_name
+        self.files_folder = os.path.join(folder, subfolder_name)
+        self.max_bytes = max_bytes
+        self.owner = owner
+        self.on_evict = on_evict
+        self._entries: Optional[Dict[str, CacheIndexEntry]] = None
+        self._total_bytes = 0
+        self._owner_ids: Optional[Tuple[int, int]] = None
+        self._folder_ready = False
+        self._lock = threading.RLock()
+
+    def get_path(self, name: str) -> str:
+        """
+        Get cache file path for a name.
+
+        :param name: cache file name
+        :return: cache file path
+        """
+        return os.path.join(self.files_folder, name)
+
+    def get_metadata(self, path: str) -> Optional[CacheMetadata]:
+        """
+        Look up the metadata for a cache file.
+
+        :param path: cache file path
+        :return: metadata or None if the file is not in the cache
+        """
+        with self._lock:
+            entry = self._get_entries().get(os.path.basename(path))
+            return entry.metadata if entry is not None else None
+
+    def touch(self, path: str):
+        """
+        Record an access to a cache file for LRU eviction.
+
+        The updated access time is saved with the next index write.
+
+        :param path: cache file path
+        """
+        with self._lock:
+            entry = self._get_entries().get(os.path.basename(path))
+            if entry is not None:
+                entry.accessed = time()
+
+    def write(self,
+              path: str,
+              write_function: Callable[[str], Any],
+              metadata: CacheMetadata):
+        """
+        Atomically write a cache file and record it in the index.
+
+        The write function writes a temporary file in the cache folder, which
+        then replaces the target file, so that a crash can never leave a
+        truncated cache file behind. Least recently used files are evicted as
+        needed to stay within the byte budget.
+
+        :param path: cache file path
+        :param write_function: function that writes a file, given its path
+        :param metadata: expiration and validators
+        :raise: I/O or other exception
+        """
+        with self._lock:
+            entries = self._get_entries()
+            self._prepare_folder()
+            # Keep the extension, because e.g. PIL uses it to choose the image format.
+            file_descriptor, temporary_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1],
+                                                               prefix=TEMPORARY_FILE_PREFIX,
+                                                               dir=self.files_folder)
+            os.close(file_descriptor)
+            try:
+                write_function(temporary_path)
+                # mkstemp() creates private files. Use normal cache file permissions.
+                os.chmod(temporary_path, 0o644)
+                self._set_owner(temporary_path)
+                size = os.path.getsize(temporary_path)
+                os.replace(temporary_path, path)
+            except Exception:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+            name = os.path.basename(path)
+            old_entry = entries.get(name)
+            if old_entry is not None:
+                self._total_bytes -= old_entry.size
+            entries[name] = CacheIndexEntry(metadata, size, time())
+            self._total_bytes += size
+            self._evict(keep_name=name)
+            self._save_index()
+
+    def update_metadata(self, path: str, metadata: CacheMetadata):
+        """
+        Replace the metadata for a cache file, e.g. after revalidation.
+
+        :param path: cache file path
+        :param metadata: new expiration and validators
+        """
+        with self._lock:
+            entry = self._get_entries().get(os.path.basename(path))
+            if entry is not None:
+                entry.metadata = metadata
+                entry.accessed = time()
+                self._save_index()
+
+    def remove(self, path: str):
+        """
+        Remove a cache file and its index entry.
+
+        :param path: cache file path
+        """
+        with self._lock:
+            entry = self._get_entries().pop(os.path.basename(path), None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+            if os.path.isfile(path):
+                os.remove(path)
+            if entry is not None:
+                self._save_index()
+
+    def _get_entries(self) -> Dict[str, CacheIndexEntry]:
+        # Caller must hold the lock.
+        if self._entries is None:
+            self._load_index()
+        return self._entries
+
+    def _load_index(self):
+        self._entries = {}
+        self._total_bytes = 0
+        index_path = self.get_path(INDEX_FILE_NAME)
+        # noinspection PyBroadException
+        try:
+            with open(index_path, encoding='utf-8') as index_file:
+                index_data = json.load(index_file)
+            if index_data.get('version') != INDEX_VERSION:
+                raise ValueError(f'unsupported index version {index_data.get("version")}')
+            for name, entry_data in index_data['entries'].items():
+                self._entries[name] = CacheIndexEntry(CacheMetadata(**entry_data['metadata']),
+                                                      entry_data['size'],
+                                                      entry_data['accessed'])
+                self._total_bytes += entry_data['size']
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            log.error(f'Discarding bad cache index "{index_path}": {exc}')
+            self._entries = {}
+            self._total_bytes = 0
+        self._reconcile()
+
+    def _save_index(self):
+        index_data = {
+            'version': INDEX_VERSION,
+            'entries': {name: asdict(entry) for name, entry in self._entries.items()},
+        }
+        index_path = self.get_path(INDEX_FILE_NAME)
+        file_descriptor, temporary_path = tempfile.mkstemp(prefix=TEMPORARY_FILE_PREFIX,
+                                                           dir=self.files_folder)
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as index_file:
+                json.dump(index_data, index_file, separators=(',', ':'))
+            os.chmod(temporary_path, 0o644)
+            self._set_owner(temporary_path)
+            os.replace(temporary_path, index_path)
+        except Exception as exc:
+            log.error(f'Failed to write cache index "{index_path}": {exc}')
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def _evict(self, keep_name: str):
+        # Remove least recently used files until the budget is met.
+        if self._total_bytes <= self.max_bytes:
+            return
+        for name, entry in sorted(self._entries.items(), key=lambda item: item[1].accessed):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if name == keep_name:
+                continue
+            log.info(f'Evict cache file: {name}')
+            del self._entries[name]
+            self._total_bytes -= entry.size
+            path = self.get_path(name)
+            if os.path.isfile(path):
+                os.remove(path)
+            if self.on_evict is not None:
+                self.on_evict(path)
+
+    def _reconcile(self):
+        # Make the index match the folder once, when the index is loaded, e.g.
+        # after a crash between replacing a file and saving the index. Files
+        # that aren't indexed are removed, so that they don't consume space
+        # that the budget can't see, and entries for missing files are dropped.
+        if not os.path.isdir(self.files_folder):
+            return
+        sizes: Dict[str, int] = {}
+        for dir_entry in os.scandir(self.files_folder):
+            if not dir_entry.is_file() or dir_entry.name == INDEX_FILE_NAME:
+                continue
+            if dir_entry.name in self._entries:
+                sizes[dir_entry.name] = dir_entry.stat().st_size
+            else:
+                log.info(f'Remove unindexed cache file: {dir_entry.name}')
+                os.remove(dir_entry.path)
+        changed = False
+        for name, entry in list(self._entries.items()):
+            size = sizes.get(name)
+            if size is None:
+                del self._entries[name]
+                changed = True
+            elif size != entry.size:
+                entry.size = size
+                changed = True
+        if changed:
+            self._total_bytes = sum(entry.size for entry in self._entries.values())
+            self._save_index()
+
+    def _prepare_folder(self):
+        if self._folder_ready:
+            return
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+            self._set_owner(self.folder)
+        if not os.path.isdir(self.files_folder):
+            os.mkdir(self.files_folder)
+            self._set_owner(self.files_folder)
+        self._folder_ready = True
+
+    def _set_owner(self, path: str):
+        # Resolve the configured owner to user/group IDs once.
+        if self.owner is None:
+            return
+        if self._owner_ids is None:
+            user_name, _separator, group_name = self.owner.partition(':')
+            try:
+                user = pwd.getpwnam(user_name)
+                group_id = grp.getgrnam(group_name).gr_gid if group_name else user.pw_gid
+            except KeyError:
+                log.error(f'Unknown cache owner "{self.owner}".')
+                self.owner = None
+                return
+            self._owner_ids = (user.pw_uid, group_id)
+        try:
+            os.chown(path, *self._owner_ids)
+        except PermissionError:
+            # Ownership can only be given away when running as root.
+            pass
@@ -0,0 +1,420 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Persistent (keep-alive) HTTP connection pool."""
+
+import http.client
+import threading
+import zlib
+from dataclasses import dataclass
+from time import time
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin, urlsplit
+
+from .dns_cache import DNSCache, create_connection
+from .logger import log
+from .typing import Interval
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_IDLE_TIMEOUT = 60
+DEFAULT_MAX_IDLE_PER_HOST = 2
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+READ_CHUNK_SIZE = 16384
+# Content-Encoding values that read_decoded() can handle.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Exceptions that indicate a reused connection was dropped by the server.
+STALE_CONNECTION_EXCEPTIONS = (http.client.RemoteDisconnected,
+                               http.client.BadStatusLine,
+                               ConnectionError)
+
+HostKey = Tuple[str, str, int]
+
+
+class ContentDecoder:
+    """
+    Incremental response body decoder for a Content-Encoding.
+
+    Handles gzip, zlib-wrapped deflate, and raw deflate content encodings.
+    """
+
+    def __init__(self, encoding: Optional[str]):
+        """
+        Content decoder constructor.
+
+        :param encoding: Content-Encoding header value, if any
+        :raise: ValueError for unsupported content encoding
+        """
+        self.encoding = (encoding or 'identity').strip().lower()
+        if self.encoding == 'identity':
+            self.decompressor = None
+        elif self.encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            raise ValueError(f'Unsupported content encoding "{self.encoding}".')
+        self.first_chunk = True
+
+    def is_identity(self) -> bool:
+        """
+        Check if the body is not encoded.
+
+        :return: True if decoding does nothing
+        """
+        return self.decompressor is None
+
+    def decode(self, chunk: bytes) -> bytes:
+        """
+        Decode a chunk of the body.
+
+        :param chunk: encoded data
+        :return: decoded data
+        :raise: zlib.error
+        """
+        if self.decompressor is None:
+            return chunk
+        try:
+            return self.decompressor.decompress(chunk)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib wrapper.
+            if self.encoding != 'deflate' or not self.first_chunk:
+                raise
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(chunk)
+        finally:
+            self.first_chunk = False
+
+    def flush(self) -> bytes:
+        """
+        Finish decoding.
+
+        :return: remaining decoded data
+        """
+        return self.decompressor.flush() if self.decompressor is not None else b''
+
+
+class CachedDNSHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection that resolves its host name through a DNS cache."""
+
+    def __init__(self, host: str, port: int, dns_cache: DNSCache, **kwargs):
+        """
+        Connection constructor.
+
+        :param host: host name
+        :param port: port number
+        :param dns_cache: DNS cache
+        :param kwargs: keyword arguments for http.client.HTTPConnection
+        """
+        super().__init__(host, port, **kwargs)
+        self._create_connection = lambda *args: create_connection(dns_cache, *args)
+
+
+class CachedDNSHTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPS connection that resolves its host name through a DNS cache.
+
+    Only the socket connects to the resolved address. TLS server name
+    indication and certificate checks still use the host name.
+    """
+
+    def __init__(self, host: str, port: int, dns_cache: DNSCache, **kwargs):
+        """
+        Connection constructor.
+
+        :param host: host name
+        :param port: port number
+        :param dns_cache: DNS cache
+        :param kwargs: keyword arguments for http.client.HTTPSConnection
+        """
+        super().__init__(host, port, **kwargs)
+        self._create_connection = lambda *args: create_connection(dns_cache, *args)
+
+
+@dataclass
+class IdleConnection:
+    """Idle connection waiting to be reused."""
+    connection: http.client.HTTPConnection
+    """Open connection."""
+    idle_time: float
+    """Time when the connection became idle."""
+
+
+class PooledResponse:
+    """
+    HTTP response that returns its connection to the pool when closed.
+
+    Should be used as a context manager. The connection is only reused if the
+    response body was fully read and the server allows keep-alive.
+    """
+
+    def __init__(self,
+                 pool: 'ConnectionPool',
+                 key: HostKey,
+                 connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse,
+                 url: str):
+        """
+        Pooled response constructor.
+
+        :param pool: pool that owns the connection
+        :param key: pool host key
+        :param connection: connection that received the response
+        :param response: http.client response
+        :param url: final URL, after following redirects
+        """
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.bytes_read = 0
+
+    @property
+    def status(self) -> int:
+        """
+        HTTP status code property.
+
+        :return: status code
+        """
+        return self.response.status
+
+    @property
+    def reason(self) -> str:
+        """
+        HTTP status reason property.
+
+        :return: reason text
+        """
+        return self.response.reason
+
+    @property
+    def headers(self) -> http.client.HTTPMessage:
+        """
+        HTTP response headers property.
+
+        :return: headers
+        """
+        return self.response.headers
+
+    def read(self, size: int = None) -> bytes:
+        """
+        Read response body data.
+
+        :param size: maximum number of bytes to read (default: all)
+        :return: body data
+        """
+        data = self.response.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read_decoded(self) -> Union[bytes, bytearray]:
+        """
+        Read and decompress the whole response body.
+
+        Decompression is incremental, one chunk at a time, so that the
+        compressed body is never held in memory in its entirety.
+
+        Handles gzip, zlib-wrapped deflate, and raw deflate content encodings.
+        Uncompressed bodies are returned as read, without a copy.
+
+        :return: decoded body data
+        :raise: ValueError for unsupported content encoding or zlib.error
+        """
+        decoder = ContentDecoder(self.headers.get('Content-Encoding'))
+        if decoder.is_identity():
+            return self.read()
+        data = bytearray()
+        while True:
+            chunk = self.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            data += decoder.decode(chunk)
+        data += decoder.flush()
+        return data
+
+    def close(self):
+        """Finish the response and release or close its connection."""
+        if self.connection is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, self.connection)
+        else:
+            self.response.close()
+            self.connection.close()
+        self.connection = None
+
+    def __enter__(self) -> 'PooledResponse':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Pool of persistent HTTP/HTTPS connections, shared across hosts.
+
+    Idle connections are kept per scheme/host/port, expire after an idle
+    timeout, and are transparently replaced when the server has dropped them.
+    """
+
+    def __init__(self,
+                 timeout: Interval = DEFAULT_TIMEOUT,
+                 idle_timeout: Interval = DEFAULT_IDLE_TIMEOUT,
+                 max_idle_per_host: int = DEFAULT_MAX_IDLE_PER_HOST,
+                 dns_cache: DNSCache = None):
+        """
+        Connection pool constructor.
+
+        :param timeout: socket timeout in seconds
+        :param idle_timeout: seconds before an idle connection is discarded
+        :param max_idle_per_host: maximum idle connections kept per host
+        :param dns_cache: optional DNS cache for resolving host names
+        """
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.dns_cache = dns_cache
+        self._idle: Dict[HostKey, List[IdleConnection]] = {}
+        self._lock = threading.Lock()
+
+    def request(self,
+                url: str,
+                headers: Dict[str, str] = None,
+                method: str = 'GET',
+                ) -> PooledResponse:
+        """
+        Send a request, following redirects, and return the response.
+
+        The caller must close the response, preferably by using it as a
+        context manager, so that the connection can be reused.
+
+        :param url: request URL
+        :param headers: request headers
+        :param method: request method
+        :return: pooled response
+        :raise: http.client, socket, or ValueError exception
+        """
+        for _redirect in range(MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers or {}, method)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            # Drain the redirect body so that the connection can be reused.
+            response.read()
+            response.close()
+            url = urljoin(url, location)
+        raise ValueError(f'Too many redirects for "{url}".')
+
+    def acquire(self, key: HostKey) -> Tuple[http.client.HTTPConnection, bool]:
+        """
+        Get an idle connection or create a new one.
+
+        :param key: (scheme, host, port) key
+        :return: (connection, reused) tuple
+        """
+        with self._lock:
+            idle_connections = self._idle.get(key, [])
+            while idle_connections:
+                idle_connection = idle_connections.pop()
+                if time() - idle_connection.idle_time < self.idle_timeout:
+                    return idle_connection.connection, True
+                idle_connection.connection.close()
+        return self._new_connection(key), False
+
+    def release(self, key: HostKey, connection: http.client.HTTPConnection):
+        """
+        Return a connection to the pool for reuse.
+
+        :param key: (scheme, host, port) key
+        :param connection: connection with no outstanding response
+        """
+        with self._lock:
+            idle_connections = self._idle.setdefault(key, [])
+            if len(idle_connections) < self.max_idle_per_host:
+                idle_connections.append(IdleConnection(connection, time()))
+                return
+        connection.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle_connections in self._idle.values():
+                for idle_connection in idle_connections:
+                    idle_connection.connection.close()
+            self._idle = {}
+
+    def _request_once(self,
+                      url: str,
+                      headers: Dict[str, str],
+                      method: str,
+                      ) -> PooledResponse:
+        key, selector = self._split_url(url)
+        connection, reused = self.acquire(key)
+        try:
+            response = self._send(connection, method, selector, headers)
+        except STALE_CONNECTION_EXCEPTIONS as exc:
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection. Reconnect and try again.
+            log.debug(f'Reconnect to {key[1]}:{key[2]} after error: {exc}')
+            connection = self._new_connection(key)
+            try:
+                response = self._send(connection, method, selector, headers)
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+        return PooledResponse(self, key, connection, response, url)
+
+    def _new_connection(self, key: HostKey) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        if self.dns_cache is not None:
+            if scheme == 'https':
+                return CachedDNSHTTPSConnection(host, port, self.dns_cache, timeout=self.timeout)
+            return CachedDNSHTTPConnection(host, port, self.dns_cache, timeout=self.timeout)
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    @staticmethod
+    def _send(connection: http.client.HTTPConnection,
+              method: str,
+              selector: str,
+              headers: Dict[str, str],
+              ) -> http.client.HTTPResponse:
+        connection.request(method, selector, headers=headers)
+        return connection.getresponse()
+
+    @staticmethod
+    def _split_url(url: str) -> Tuple[HostKey, str]:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported URL scheme "{parts.scheme}".')
+        if not parts.hostname:
+            raise ValueError(f'URL "{url}" has no host name.')
+        port = parts.port or (443 if scheme == 'https' else 80)
+        selector = parts.path or '/'
+        if parts.query:
+            selector = f'{selector}?{parts.query}'
+        return (scheme, parts.hostname, port), selector
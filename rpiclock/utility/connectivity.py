@@ -0,0 +1,178 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Cheap network connectivity checks for skipping doomed requests."""
+
+import ipaddress
+import socket
+import threading
+from time import time
+from typing import Dict, Optional
+
+from .logger import log
+
+IPV4_ROUTE_TABLE_PATH = '/proc/net/route'
+IPV6_ROUTE_TABLE_PATH = '/proc/net/ipv6_route'
+OPERSTATE_PATH = '/sys/class/net/{interface}/operstate'
+# Point-to-point and virtual interfaces may report "unknown" while working.
+USABLE_OPERSTATES = ('up', 'unknown')
+RTF_UP = 0x1
+DEFAULT_CHECK_INTERVAL = 2.0
+DEFAULT_NEGATIVE_DNS_TTL = 60.0
+# Host names that resolve to loopback or link-local (mDNS) addresses.
+LOCAL_HOST_NAMES = ('localhost',)
+LOCAL_HOST_SUFFIXES = ('.localhost', '.local')
+
+
+def is_local_host(host: str) -> bool:
+    """
+    Check if a host is on the local machine or network, without name lookups.
+
+    :param host: host name or IP address
+    :return: True for loopback, private, and link-local addresses, and local host names
+    """
+    host = host.lower().rstrip('.')
+    try:
+        address = ipaddress.ip_address(host.strip('[]'))
+    except ValueError:
+        return host in LOCAL_HOST_NAMES or host.endswith(LOCAL_HOST_SUFFIXES)
+    return address.is_loopback or address.is_private or address.is_link_local
+
+
+class ConnectivityMonitor:
+    """
+    Connectivity oracle based on the routing table and cached DNS failures.
+
+    The network is considered online when there is a default route through
+    an interface that is up. The check only reads a few small kernel files,
+    and its result is reused for the check interval. Host name lookup
+    failures are cached for each host. Cached failures are forgotten as soon
+    as connectivity is regained, so that requests are retried immediately.
+
+    Systems without the Linux routing table files are always considered
+    online. Local hosts, e.g. a replay server or a LAN cache proxy, remain
+    reachable without a default route.
+    """
+
+    def __init__(self,
+                 check_interval: float = DEFAULT_CHECK_INTERVAL,
+                 negative_dns_ttl: float = DEFAULT_NEGATIVE_DNS_TTL):
+        """
+        Connectivity monitor constructor.
+
+        :param check_interval: seconds to reuse a routing table check
+        :param negative_dns_ttl: seconds to skip a host after its name lookup fails
+        """
+        self.check_interval = check_interval
+        self.negative_dns_ttl = negative_dns_ttl
+        self._online: Optional[bool] = None
+        self._check_time = 0.0
+        # Negative DNS cache expiration times by host name.
+        self._dns_failures: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_online(self) -> bool:
+        """
+        Check for a usable default route.
+
+        :return: True if the network appears to be online
+        """
+        with self._lock:
+            now = time()
+            if self._online is None or now - self._check_time >= self.check_interval:
+                self._check_time = now
+                online = self._check_routes()
+                if online != self._online:
+                    if online:
+                        if self._online is not None:
+                            log.warning('Network connectivity is back.')
+                        self._dns_failures.clear()
+                    else:
+                        log.warning('Network is offline, using cached data only.')
+                    self._online = online
+            return self._online
+
+    def is_reachable(self, host: str) -> bool:
+        """
+        Check if a request to a host may succeed.
+
+        :param host: host name
+        :return: False if the network is offline or the host name recently failed to resolve
+        """
+        if not is_local_host(host) and not self.is_online():
+            return False
+        with self._lock:
+            expires = self._dns_failures.get(host)
+            if expires is None:
+                return True
+            if time() < expires:
+                return False
+            del self._dns_failures[host]
+            return True
+
+    def record_failure(self, host: str, exc: Exception):
+        """
+        Record a request failure, caching host name lookup failures.
+
+        :param host: host name
+        :param exc: request exception
+        """
+        if isinstance(exc, socket.gaierror):
+            with self._lock:
+                self._dns_failures[host] = time() + self.negative_dns_ttl
+            log.warning(f'Skip requests to "{host}" for {self.negative_dns_ttl:.0f}'
+                        f' seconds after a failed name lookup.')
+
+    @classmethod
+    def _check_routes(cls) -> bool:
+        try:
+            with open(IPV4_ROUTE_TABLE_PATH, encoding='ascii') as route_file:
+                ipv4_lines = route_file.readlines()[1:]
+        except OSError:
+            return True
+        # Columns: Iface Destination Gateway Flags RefCnt Use Metric Mask ...
+        for line in ipv4_lines:
+            fields = line.split()
+            if (len(fields) >= 8
+                    and fields[1] == '00000000'
+                    and fields[7] == '00000000'
+                    and int(fields[3], 16) & RTF_UP
+                    and cls._is_interface_up(fields[0])):
+                return True
+        try:
+            with open(IPV6_ROUTE_TABLE_PATH, encoding='ascii') as route_file:
+                ipv6_lines = route_file.readlines()
+        except OSError:
+            return False
+        # Columns: Destination PrefixLength Source PrefixLength NextHop Metric RefCnt Use Flags Iface
+        for line in ipv6_lines:
+            fields = line.split()
+            if (len(fields) >= 10
+                    and fields[1] == '00'
+                    and fields[9] != 'lo'
+                    and int(fields[8], 16) & RTF_UP
+                    and cls._is_interface_up(fields[9])):
+                return True
+        return False
+
+    @staticmethod
+    def _is_interface_up(interface: str) -> bool:
+        try:
+            with open(OPERSTATE_PATH.format(interface=interface), encoding='ascii') as operstate_file:
+                return operstate_file.read().strip() in USABLE_OPERSTATES
+        except OSError:
+            return True
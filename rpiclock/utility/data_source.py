@@ -17,23 +17,53 @@
 
 """Internet data source support classes."""
 
+import asyncio
 import json
-import os
 import re
+import threading
+import zlib
 from dataclasses import dataclass
-from io import BytesIO, BufferedRandom
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from io import BytesIO
 from PIL import Image
 from time import time
-from urllib.parse import quote
-from urllib.request import urlopen, Request
-from typing import Dict, List, Optional, Union, Any, Tuple
-
+from urllib.parse import quote, urlsplit
+from typing import Dict, List, Optional, Union, Any, Callable, Tuple, Type
+
+from .async_http import AsyncConnectionPool
+from .cache_store import CacheStore, CacheMetadata
+from .connection_pool import ConnectionPool, ACCEPT_ENCODING
+from .connectivity import ConnectivityMonitor
+from .data_source_metrics import DataSourceMetrics, MetricsRegistry
+from .dns_cache import DNSCache
+from .event_loop_thread import EventLoopThread
+from .image_data import ImageData, RAW_IMAGE_EXTENSION, read_raw_image, write_raw_image
+from .jitter import Jitter
+from .json_schema import Schema, compile_schema
 from .logger import log
+from .memory_cache import MemoryCache
+from .prefetch_scheduler import PrefetchScheduler
+from .rate_limiter import RateLimiter
+from .replay import ResponseRecorder
 from .typing import Interval
 
-Schema = Union[Dict[str, Union[type, 'Schema']], List['Schema']]
+# Projection tree nodes map property names to child nodes. Empty nodes keep
+# the entire value.
+ProjectionTree = Dict[str, 'ProjectionTree']
 
 URL_STRIP_REGEX = re.compile(r'^[^/:]+://')
+MAX_AGE_REGEX = re.compile(r'(?:^|,)\s*max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+NO_CACHE_REGEX = re.compile(r'(?:^|,)\s*no-(?:cache|store)\b', re.IGNORECASE)
+
+# Identical requests made within this interval share a single result.
+COALESCE_INTERVAL = 1.0
+DEFAULT_MAX_CONCURRENT_FETCHES = 4
+
+
+class DataSourceError(Exception):
+    """Data source exception used internally."""
+    pass
 
 
 @dataclass
@@ -45,10 +75,112 @@ class DownloadResult:
     """Cached data."""
 
 
+class PendingDownload:
+    """Download shared by all callers requesting the same URL."""
+
+    def __init__(self):
+        """Pending download constructor."""
+        self.done = threading.Event()
+        self.data: Optional[Any] = None
+        self.finish_time: Optional[float] = None
+
+    def is_shareable(self) -> bool:
+        """
+        Check if the download is still in progress or recent enough to share.
+
+        Failed results are not shared after completion, so that requests are
+        retried, e.g. as soon as the network is back online.
+
+        :return: True if a new request should wait for and use this result
+        """
+        return (not self.done.is_set()
+                or (self.data is not None and time() - self.finish_time < COALESCE_INTERVAL))
+
+
+class PendingFetch:
+    """Asynchronous fetch shared by all callers requesting the same URL."""
+
+    def __init__(self, future: asyncio.Future):
+        """
+        Pending fetch constructor.
+
+        :param future: fetch task
+        """
+        self.future = future
+        self.waiters = 0
+
+
+def get_cache_lifetime(headers: Message) -> Optional[float]:
+    """
+    Determine response lifetime from Cache-Control or Expires headers.
+
+    Cache-Control max-age takes precedence over Expires, which is measured
+    relative to the Date header, if present, to avoid clock skew problems.
+
+    :param headers: HTTP response headers
+    :return: lifetime in seconds or None if the server did not specify one
+    """
+    cache_control = headers.get('Cache-Control')
+    if cache_control:
+        max_age_match = MAX_AGE_REGEX.search(cache_control)
+        if max_age_match is not None:
+            return float(max_age_match.group(1))
+        if NO_CACHE_REGEX.search(cache_control):
+            return 0
+    expires = headers.get('Expires')
+    if expires:
+        # noinspection PyBroadException
+        try:
+            expires_time = parsedate_to_datetime(expires).timestamp()
+        except Exception:
+            # Invalid Expires values, e.g. "0", mean already expired.
+            return 0
+        date = headers.get('Date')
+        # noinspection PyBroadException
+        try:
+            date_time = parsedate_to_datetime(date).timestamp() if date else time()
+        except Exception:
+            date_time = time()
+        return max(expires_time - date_time, 0)
+    return None
+
+
 class DataSource:
     """Generic data source with optional caching to minimize API usage."""
 
-    cache_folder = '/tmp/rpi-clock-cache'
+    # Parsed data is kept in memory to avoid re-reading and re-parsing cache files.
+    memory_cache = MemoryCache()
+    # Cache files, with a byte budget and index, are shared by all data sources.
+    cache_store = CacheStore(on_evict=memory_cache.remove)
+    # Requests are skipped while the network is known to be offline.
+    connectivity = ConnectivityMonitor()
+    # Resolved host addresses, refreshed in the background, are shared by all data sources.
+    dns_cache = DNSCache(connectivity=connectivity)
+    # Keep-alive connections, for download() and fetch(), are shared by all data sources.
+    connection_pool = ConnectionPool(dns_cache=dns_cache)
+    async_connection_pool = AsyncConnectionPool(dns_cache=dns_cache)
+    # Outbound request budget for each host is shared by all data sources.
+    rate_limiter = RateLimiter()
+    # Per-device cache lifetime jitter keeps a fleet of clocks from refreshing in lock step.
+    jitter = Jitter()
+    # Background refresh of cache entries before they expire, if enabled.
+    prefetch_scheduler: Optional[PrefetchScheduler] = PrefetchScheduler()
+    # Cache and network metrics by data source name.
+    metrics = MetricsRegistry()
+    # Interval for logging metrics, if enabled.
+    metrics_interval: Optional[Interval] = None
+    # Optional recorder that captures responses for replay testing.
+    recorder: Optional[ResponseRecorder] = None
+    # Concurrent or same-tick downloads by (class, URL) for request coalescing.
+    _pending_downloads: Dict[Tuple[Type['DataSource'], str], PendingDownload] = {}
+    _pending_downloads_lock = threading.Lock()
+    # Maximum concurrent asynchronous fetches, and the semaphore for the running event loop.
+    max_concurrent_fetches = DEFAULT_MAX_CONCURRENT_FETCHES
+    _fetch_semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+    # In-progress asynchronous fetches by (class, cache path) for request coalescing.
+    _pending_fetches: Dict[Tuple[Type['DataSource'], str], PendingFetch] = {}
+    # Long-lived event loop for asynchronous fetches by callers that must not wait.
+    event_loop = EventLoopThread()
 
     def __init__(self,
                  name: str,
@@ -75,6 +207,113 @@ class DataSource:
         else:
             self.url: Optional[str] = None
         self.frequency = frequency
+        # Latest network or HTTP failure time by cache path.
+        self._failure_times: Dict[str, float] = {}
+
+    @classmethod
+    def configure(cls,
+                  cache_folder: str = None,
+                  cache_subfolder: str = None,
+                  cache_owner: Optional[str] = '',
+                  cache_max_bytes: int = None,
+                  record_folder: str = None,
+                  rate_limit: float = None,
+                  rate_burst: int = None,
+                  rate_max_wait: float = None,
+                  prefetch: bool = None,
+                  prefetch_lead: float = None,
+                  prefetch_idle_timeout: float = None,
+                  metrics_interval: Interval = None,
+                  max_concurrent_fetches: int = None,
+                  connectivity_check_interval: float = None,
+                  negative_dns_ttl: float = None,
+                  dns_ttl: float = None,
+                  jitter: float = None,
+                  jitter_seed: str = None,
+                  ):
+        """
+        Apply global data source configuration.
+
+        Should be called before any data is downloaded.
+
+        The cache owner allows that user to delete the cache when the
+        application runs as root.
+
+        :param cache_folder: parent folder for the cache sub-folder
+        :param cache_subfolder: cache sub-folder name, which must not be shared by processes
+        :param cache_owner: cache owner "user" or "user:group", or None for no owner change
+        :param cache_max_bytes: maximum total size of cache files
+        :param record_folder: optional folder for recording responses for replay
+        :param rate_limit: sustained requests per second for each host
+        :param rate_burst: maximum requests in a burst for each host
+        :param rate_max_wait: maximum seconds for a background thread to wait for a turn when there is no cached data
+        :param prefetch: refresh cache entries in the background before they expire if True
+        :param prefetch_lead: seconds before expiration to refresh cache entries
+        :param prefetch_idle_timeout: seconds without requests before prefetching stops
+        :param metrics_interval: optional interval in seconds for logging metrics
+        :param max_concurrent_fetches: maximum concurrent asynchronous fetches
+        :param connectivity_check_interval: seconds to reuse a network connectivity check
+        :param negative_dns_ttl: seconds to skip a host after its name lookup fails
+        :param dns_ttl: seconds to keep resolved host addresses, within fixed limits
+        :param jitter: maximum fraction of cache lifetimes and poll intervals to subtract per device
+        :param jitter_seed: per-device jitter seed (default: host name)
+        """
+        if record_folder is not None:
+            log.info(f'Record data source responses to "{record_folder}".')
+            DataSource.recorder = ResponseRecorder(record_folder)
+        cache_store = DataSource.cache_store
+        DataSource.cache_store = CacheStore(
+            folder=cache_folder if cache_folder is not None else cache_store.folder,
+            max_bytes=cache_max_bytes if cache_max_bytes is not None else cache_store.max_bytes,
+            owner=cache_owner if cache_owner != '' else cache_store.owner,
+            on_evict=DataSource.memory_cache.remove,
+            subfolder_name=cache_subfolder if cache_subfolder is not None else cache_store.subfolder_name)
+        DataSource.memory_cache.clear()
+        rate_limiter = DataSource.rate_limiter
+        DataSource.rate_limiter = RateLimiter(
+            rate=rate_limit if rate_limit is not None else rate_limiter.rate,
+            burst=rate_burst if rate_burst is not None else rate_limiter.burst,
+            max_wait=rate_max_wait if rate_max_wait is not None else rate_limiter.max_wait)
+        if prefetch is not None:
+            if DataSource.prefetch_scheduler is not None:
+                DataSource.prefetch_scheduler.stop()
+            DataSource.prefetch_scheduler = PrefetchScheduler() if prefetch else None
+        if DataSource.prefetch_scheduler is not None:
+            if prefetch_lead is not None:
+                DataSource.prefetch_scheduler.lead = prefetch_lead
+            if prefetch_idle_timeout is not None:
+                DataSource.prefetch_scheduler.idle_timeout = prefetch_idle_timeout
+        if metrics_interval is not None:
+            DataSource.metrics_interval = metrics_interval
+        if max_concurrent_fetches is not None:
+            DataSource.max_concurrent_fetches = max_concurrent_fetches
+            DataSource._fetch_semaphore = None
+        if connectivity_check_interval is not None:
+            DataSource.connectivity.check_interval = connectivity_check_interval
+        if negative_dns_ttl is not None:
+            DataSource.connectivity.negative_dns_ttl = negative_dns_ttl
+        if dns_ttl is not None:
+            DataSource.dns_cache.ttl = dns_ttl
+        if jitter is not None:
+            DataSource.jitter.fraction = jitter
+        if jitter_seed is not None:
+            DataSource.jitter.seed = jitter_seed
+
+    @classmethod
+    def get_metrics(cls) -> Dict[str, DataSourceMetrics]:
+        """
+        Get a snapshot of cache and network metrics.
+
+        :return: metrics by data source name
+        """
+        return cls.metrics.get_snapshot()
+
+    @classmethod
+    def log_metrics(cls):
+        """Log cache and network metrics for all data sources."""
+        for name, metrics in sorted(cls.get_metrics().items()):
+            # Use the warning level, which is visible by default.
+            log.warning(f'Data source "{name}" metrics: {metrics.format()}')
 
     def get_cache_path(self, url: str) -> str:
         """
@@ -88,36 +327,53 @@ class DataSource:
         strip_match = URL_STRIP_REGEX.match(url)
         if strip_match is not None:
             url = url[strip_match.end():]
-        base_path = os.path.join(self.cache_folder, quote(url).replace('/', '_'))
+        base_path = self.cache_store.get_path(quote(url).replace('/', '_'))
         return self.on_generate_cache_path(url, base_path)
 
-    def load_cache(self, path: str, frequency: Interval) -> Optional[Any]:
+    def get_expiration(self, headers: Message = None, jitter_key: str = None) -> Optional[float]:
         """
-        Cached data reading and expiration handling.
+        Calculate cache expiration time for fresh data.
 
-        Deletes cache files when they expire.
+        Server-provided Cache-Control or Expires lifetimes take precedence over
+        the configured frequency, except that frequency zero is always honored
+        by never expiring.
 
-        Cache frequency zero is only downloaded once and never replaced.
+        Lifetimes are shortened by the per-device jitter, so that devices
+        sharing a schedule don't all refresh the same data at once.
+
+        :param headers: optional HTTP response headers
+        :param jitter_key: jitter key, e.g. the cache path (default: data source name)
+        :return: expiration time or None if it never expires
+        """
+        if not self.frequency:
+            return None
+        lifetime = get_cache_lifetime(headers) if headers is not None else None
+        if lifetime is None:
+            lifetime = self.frequency
+        return time() + self.jitter.apply(lifetime, jitter_key or self.name)
+
+    def load_cache(self, path: str) -> Optional[Any]:
+        """
+        Cached data reading.
+
+        Deletes cache files that fail to load. Expiration is checked by the
+        caller, because expired data may still be revalidated by the server.
 
         :param path: cache file path
-        :param frequency: update/cache frequency in seconds (default: not cached)
-        :return: data if cache is available and has not expired
+        :return: data if cache is available and loads successfully
         """
-        if frequency > 0:
-            mtime = os.path.getmtime(path)
-            if time() - mtime > frequency:
-                os.remove(path)
-                return None
+        start_time = time()
         try:
             return self.on_load_cache_file(path)
         except Exception as exc:
             log.error(f'Data source "{self.name}" failed to load data from cache'
                       f' file "{path}": {exc}')
-            if os.path.isfile(path):
-                os.remove(path)
+            self.remove_cache(path)
             return None
+        finally:
+            self.metrics.time(self.name, 'parse_time', time() - start_time)
 
-    def save_cache(self, path: str, data: Union[str, bytes]) -> bool:
+    def save_cache(self, path: str, data: Union[str, bytes], metadata: CacheMetadata) -> bool:
         """
         Write cache data.
 
@@ -126,24 +382,30 @@ class DataSource:
 
         :param path: cache file path
         :param data: downloaded data to save to cache
+        :param metadata: cache expiration and validators
         :return: True if successful
         """
         try:
-            folder = os.path.dirname(path)
-            # TODO: The hard-coded "chown" allows the "pi" user to delete the cache.
-            if not os.path.isdir(folder):
-                os.system(f'mkdir {folder}')
-                os.system(f'chown pi:pi {folder}')
-            self.on_save_cache_file(path, data)
-            os.system(f'chown pi:pi {path}')
+            self.cache_store.write(path,
+                                   lambda temporary_path: self.on_save_cache_file(temporary_path, data),
+                                   metadata)
             return True
         except Exception as exc:
             log.error(f'Data source "{self.name}" failed to write data to cache'
                       f' file "{path}": {exc}')
-            if os.path.isfile(path):
-                os.remove(path)
+            self.remove_cache(path)
             return False
 
+    @classmethod
+    def remove_cache(cls, path: str):
+        """
+        Remove cache file, its index entry, and any in-memory copy.
+
+        :param path: cache file path
+        """
+        cls.memory_cache.remove(path)
+        cls.cache_store.remove(path)
+
     def download(self, *args, **kwargs) -> Optional[Any]:
         """
         Download data from possibly-parameterized URL.
@@ -151,10 +413,106 @@ class DataSource:
         The first positional argument must be a URL if no base URL was given to
         the constructor.
 
+        Expired cache data with an ETag or Last-Modified validator is
+        revalidated with a conditional request. A 304 (Not Modified) response
+        refreshes the existing cache entry without downloading it again.
+
+        Concurrent or closely-spaced (same tick) requests for the same cached
+        URL by any data source of the same class are coalesced into a single fetch,
+        and all callers receive the same result.
+
+        Requests to each host share a token bucket budget, which smooths out
+        bursts. Requests over budget use expired cache data, if available.
+        Otherwise, background threads wait briefly for a turn, and fail if none
+        comes. The main (UI) thread never waits. Its requests over budget fail
+        immediately, and are handed to the prefetch scheduler, if enabled, to
+        be downloaded in the background, so that a later request finds the data.
+
+        Requests also use expired cache data, if available, without trying the
+        network while it is offline or the host name recently failed to resolve.
+
+        Expiring cache entries are refreshed in the background by the prefetch
+        scheduler, if enabled, so that requests normally find fresh data.
+
+        :param args: positional parameters to resolve URL template fields
+        :param kwargs: keyword parameters to resolve URL template fields
+        :return: data if successful or None otherwise
+        """
+        url = self.resolve_url(*args, **kwargs)
+        if url is None:
+            return None
+        cache_path = self.get_cache_path(url)
+        data = self._coalesced_download(url, cache_path)
+        self._demand_prefetch(url, cache_path, data)
+        return data
+
+    async def fetch(self, *args, **kwargs) -> Optional[Any]:
+        """
+        Asynchronous download() for use with an asyncio event loop, normally
+        the shared event_loop thread, e.g. via event_loop.submit().
+
+        Takes the same arguments, and shares the same caches, rate limits,
+        and metrics as download(). Concurrent fetches of the same URL are
+        coalesced, and the number of fetches using the network at once is
+        limited by the max_concurrent_fetches configuration.
+
+        Cancelling a caller only cancels the shared fetch if no other caller
+        is waiting for it. Cache file access and data processing are not
+        asynchronous, but are normally quick.
+
         :param args: positional parameters to resolve URL template fields
         :param kwargs: keyword parameters to resolve URL template fields
         :return: data if successful or None otherwise
         """
+        url = self.resolve_url(*args, **kwargs)
+        if url is None:
+            return None
+        cache_path = self.get_cache_path(url)
+        key = (self.__class__, cache_path)
+        pending_fetch = self._pending_fetches.get(key)
+        if pending_fetch is None:
+            pending_fetch = PendingFetch(asyncio.ensure_future(self._fetch(url, cache_path)))
+            self._pending_fetches[key] = pending_fetch
+
+            def _on_done(_future: asyncio.Future):
+                if self._pending_fetches.get(key) is pending_fetch:
+                    del self._pending_fetches[key]
+
+            pending_fetch.future.add_done_callback(_on_done)
+        else:
+            self.metrics.count(self.name, 'coalesced')
+        pending_fetch.waiters += 1
+        try:
+            data = await asyncio.shield(pending_fetch.future)
+        except asyncio.CancelledError:
+            if pending_fetch.waiters == 1:
+                pending_fetch.future.cancel()
+            raise
+        finally:
+            pending_fetch.waiters -= 1
+        self._demand_prefetch(url, cache_path, data)
+        return data
+
+    def get_failure_time(self, url: str) -> Optional[float]:
+        """
+        Get the time of the latest network or HTTP failure for a URL.
+
+        Requests skipped locally, e.g. while offline or rate limited, are not
+        failures, even though they may return no data.
+
+        :param url: resolved URL
+        :return: failure time or None if no request for the URL has failed
+        """
+        return self._failure_times.get(self.get_cache_path(url))
+
+    def resolve_url(self, *args, **kwargs) -> Optional[str]:
+        """
+        Resolve the URL template using download() arguments.
+
+        :param args: positional parameters to resolve URL template fields
+        :param kwargs: keyword parameters to resolve URL template fields
+        :return: resolved URL or None if no URL is available
+        """
         if self.url is None:
             if not args:
                 log.error(f'Data source "{self.name}" download call requires'
@@ -164,34 +522,275 @@ class DataSource:
             args = args[1:]
         else:
             url_template = self.url
-        url = url_template.format(*args, **kwargs)
-        cache_path = self.get_cache_path(url)
-        if self.frequency is not None and os.path.isfile(cache_path):
-            cache_data = self.load_cache(cache_path, self.frequency)
-            if cache_data is not None:
-                log.info(f'Load cache: {cache_path}')
-                return cache_data
+        return url_template.format(*args, **kwargs)
+
+    def _coalesced_download(self, url: str, cache_path: str, refresh: bool = False) -> Optional[Any]:
+        key = (self.__class__, cache_path)
+        with self._pending_downloads_lock:
+            pending_download = self._pending_downloads.get(key)
+            # Refreshes only share downloads that are still in progress.
+            is_owner = (pending_download is None
+                        or not pending_download.is_shareable()
+                        or (refresh and pending_download.done.is_set()))
+            if is_owner:
+                self._prune_pending_downloads()
+                pending_download = PendingDownload()
+                self._pending_downloads[key] = pending_download
+        if not is_owner:
+            self.metrics.count(self.name, 'coalesced')
+            pending_download.done.wait()
+            return pending_download.data
+        try:
+            pending_download.data = self._download(url, cache_path, refresh=refresh)
+            if pending_download.data is None:
+                self.metrics.count(self.name, 'failures')
+        finally:
+            pending_download.finish_time = time()
+            pending_download.done.set()
+        return pending_download.data
+
+    def _demand_prefetch(self, url: str, cache_path: str, data: Optional[Any]):
+        prefetch_scheduler = self.prefetch_scheduler
+        if prefetch_scheduler is not None and self.frequency and data is not None:
+            metadata = self.cache_store.get_metadata(cache_path)
+            if metadata is not None:
+                prefetch_scheduler.demand(cache_path,
+                                          metadata.expires,
+                                          lambda: self._prefetch(url, cache_path))
+
+    def _defer_download(self, url: str, cache_path: str, metadata: Optional[CacheMetadata]):
+        # The main thread must not sleep waiting for a rate limiter turn, so the
+        # prefetch thread downloads the data instead, retrying with backoff.
+        prefetch_scheduler = self.prefetch_scheduler
+        if prefetch_scheduler is not None and self.frequency:
+            prefetch_scheduler.defer(cache_path,
+                                     metadata.expires if metadata is not None else None,
+                                     lambda: self._prefetch(url, cache_path))
+
+    def _prefetch(self, url: str, cache_path: str) -> Optional[float]:
+        # Called by the prefetch scheduler thread. Returns the new expiration time.
+        self._coalesced_download(url, cache_path, refresh=True)
+        metadata = self.cache_store.get_metadata(cache_path)
+        return metadata.expires if metadata is not None else None
+
+    def _download(self, url: str, cache_path: str, refresh: bool = False) -> Optional[Any]:
+        cache_data, metadata = self._check_cache(cache_path, refresh=refresh)
+        if cache_data is not None:
+            return cache_data
+        url_parts = urlsplit(url)
+        if not self.connectivity.is_reachable(url_parts.hostname):
+            return self._load_stale_cache(url, cache_path, metadata, offline=True)
+        is_main_thread = threading.current_thread() is threading.main_thread()
+        if not self.rate_limiter.acquire(url_parts.netloc,
+                                         max_wait=0 if metadata is not None or is_main_thread else None):
+            if is_main_thread:
+                self._defer_download(url, cache_path, metadata)
+            return self._load_stale_cache(url, cache_path, metadata)
+        if metadata is not None and not metadata.has_validators():
+            metadata = None
         # noinspection PyBroadException
         try:
             log.info(f'Download: {url}')
-            request = Request(url)
-            # The National Weather Service wants the User-Agent header. For some
-            # unknown reason, the Accept header is needed in order to receive
-            # data for the correct timezone, or to properly handle local time.
-            request.add_header('User-Agent', self.user_agent)
-            request.add_header('Accept', '*/*')
-            response = urlopen(request)
-            raw_data = response.read()
-            download = self.on_process_download(raw_data, cache_path)
-            if download.cache is not None:
-                if not self.save_cache(cache_path, download.cache):
-                    return None
-            return download.data
+            start_time = time()
+            with self.connection_pool.request(url, self._get_request_headers(metadata)) as response:
+                if response.status == 304 and metadata is not None:
+                    response.read()
+                    self._count_fetch(response.bytes_read, time() - start_time)
+                    self.metrics.count(self.name, 'not_modified')
+                    return self._refresh_cache(cache_path, metadata, response.headers)
+                raw_data = response.read_decoded()
+            self._count_fetch(response.bytes_read, time() - start_time)
+            return self._process_response(url,
+                                          cache_path,
+                                          response.status,
+                                          response.reason,
+                                          response.headers,
+                                          raw_data,
+                                          time() - start_time)
         except Exception as exc:
+            self._failure_times[cache_path] = time()
+            self.connectivity.record_failure(url_parts.hostname, exc)
             log.error(f'Data source "{self.name}" failed to download data'
                       f' from "{url}": {exc}')
             return None
 
+    async def _fetch(self, url: str, cache_path: str) -> Optional[Any]:
+        # Asynchronous equivalent of _download(), also counting failures.
+        data = await self._fetch_data(url, cache_path)
+        if data is None:
+            self.metrics.count(self.name, 'failures')
+        return data
+
+    async def _fetch_data(self, url: str, cache_path: str) -> Optional[Any]:
+        cache_data, metadata = self._check_cache(cache_path)
+        if cache_data is not None:
+            return cache_data
+        url_parts = urlsplit(url)
+        if not self.connectivity.is_reachable(url_parts.hostname):
+            return self._load_stale_cache(url, cache_path, metadata, offline=True)
+        async with self._get_fetch_semaphore():
+            wait = self.rate_limiter.reserve(url_parts.netloc,
+                                             max_wait=0 if metadata is not None else None)
+            if wait is None:
+                return self._load_stale_cache(url, cache_path, metadata)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if metadata is not None and not metadata.has_validators():
+                metadata = None
+            # noinspection PyBroadException
+            try:
+                log.info(f'Fetch: {url}')
+                start_time = time()
+                response = await self.async_connection_pool.request(url, self._get_request_headers(metadata))
+                self._count_fetch(response.bytes_read, time() - start_time)
+                if response.status == 304 and metadata is not None:
+                    self.metrics.count(self.name, 'not_modified')
+                    return self._refresh_cache(cache_path, metadata, response.headers)
+                return self._process_response(url,
+                                              cache_path,
+                                              response.status,
+                                              response.reason,
+                                              response.headers,
+                                              response.body,
+                                              time() - start_time)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self._failure_times[cache_path] = time()
+                self.connectivity.record_failure(url_parts.hostname, exc)
+                log.error(f'Data source "{self.name}" failed to fetch data'
+                          f' from "{url}": {exc}')
+                return None
+
+    @classmethod
+    def _get_fetch_semaphore(cls) -> asyncio.Semaphore:
+        # Semaphores belong to an event loop, so replace it for a new loop.
+        loop = asyncio.get_event_loop()
+        if cls._fetch_semaphore is None or cls._fetch_semaphore[0] is not loop:
+            DataSource._fetch_semaphore = (loop, asyncio.Semaphore(cls.max_concurrent_fetches))
+        return cls._fetch_semaphore[1]
+
+    def _check_cache(self,
+                     cache_path: str,
+                     refresh: bool = False,
+                     ) -> Tuple[Optional[Any], Optional[CacheMetadata]]:
+        # Returns (data, None) for unexpired cache data, or (None, metadata)
+        # when there is no usable data. Metadata is for expired data, or for
+        # unexpired data when refreshing, which ignores it, but revalidates it.
+        if self.frequency is None:
+            return None, None
+        # The in-memory cache is checked first. The cache file provides
+        # persistence across restarts.
+        cache_data = self.memory_cache.get(cache_path) if not refresh else None
+        if cache_data is not None:
+            self.metrics.count(self.name, 'memory_hits')
+            self.cache_store.touch(cache_path)
+            return cache_data, None
+        metadata = self.cache_store.get_metadata(cache_path)
+        if metadata is not None and not metadata.is_expired() and not refresh:
+            cache_data = self.load_cache(cache_path)
+            if cache_data is not None:
+                log.info(f'Load cache: {cache_path}')
+                self.metrics.count(self.name, 'disk_hits')
+                self.cache_store.touch(cache_path)
+                self.memory_cache.put(cache_path, cache_data, metadata.expires)
+                return cache_data, None
+            metadata = None
+        return None, metadata
+
+    def _load_stale_cache(self,
+                          url: str,
+                          cache_path: str,
+                          metadata: Optional[CacheMetadata],
+                          offline: bool = False,
+                          ) -> Optional[Any]:
+        # Cache data is served, without waiting, if over budget or offline.
+        cache_data = self.load_cache(cache_path) if metadata is not None else None
+        if cache_data is not None:
+            log.info(f'{"Offline" if offline else "Rate limited"}, load cache: {cache_path}')
+            self.metrics.count(self.name, 'stale_hits')
+            return cache_data
+        if offline:
+            # The connectivity monitor logs outages once, rather than for each request.
+            log.info(f'Offline, skip download: {url}')
+        else:
+            log.error(f'Data source "{self.name}" is over the request rate limit'
+                      f' for "{url}".')
+        return None
+
+    def _get_request_headers(self, metadata: Optional[CacheMetadata]) -> Dict[str, str]:
+        # The National Weather Service wants the User-Agent header. For some
+        # unknown reason, the Accept header is needed in order to receive
+        # data for the correct timezone, or to properly handle local time.
+        headers = {'User-Agent': self.user_agent,
+                   'Accept': '*/*',
+                   'Accept-Encoding': ACCEPT_ENCODING}
+        if metadata is not None:
+            if metadata.etag:
+                headers['If-None-Match'] = metadata.etag
+            if metadata.last_modified:
+                headers['If-Modified-Since'] = metadata.last_modified
+        return headers
+
+    def _process_response(self,
+                          url: str,
+                          cache_path: str,
+                          status: int,
+                          reason: str,
+                          headers: Message,
+                          raw_data: Union[bytes, bytearray],
+                          elapsed: float,
+                          ) -> Optional[Any]:
+        # Process, cache, and return downloaded data.
+        if self.recorder is not None:
+            self.recorder.record(url, status, headers.items(), bytes(raw_data), elapsed)
+        if status != 200:
+            raise DataSourceError(f'HTTP error {status}: {reason}')
+        parse_start_time = time()
+        download = self.on_process_download(raw_data, cache_path)
+        self.metrics.time(self.name, 'parse_time', time() - parse_start_time)
+        if download.cache is not None:
+            metadata = CacheMetadata(self.get_expiration(headers, jitter_key=cache_path),
+                                     etag=headers.get('ETag'),
+                                     last_modified=headers.get('Last-Modified'),
+                                     content_type=headers.get('Content-Type'))
+            if not self.save_cache(cache_path, download.cache, metadata):
+                return None
+            if self.frequency is not None:
+                self.memory_cache.put(cache_path, download.data, metadata.expires)
+        return download.data
+
+    def _count_fetch(self, bytes_read: int, elapsed: float):
+        self.metrics.count(self.name, 'fetches')
+        self.metrics.count(self.name, 'bytes_in', bytes_read)
+        self.metrics.time(self.name, 'fetch_latency', elapsed)
+
+    @classmethod
+    def _prune_pending_downloads(cls):
+        # Caller must hold the lock.
+        for key in [key for key, pending_download in cls._pending_downloads.items()
+                    if not pending_download.is_shareable()]:
+            del cls._pending_downloads[key]
+
+    def _refresh_cache(self,
+                       cache_path: str,
+                       metadata: CacheMetadata,
+                       headers: Message,
+                       ) -> Optional[Any]:
+        # Handle a 304 (Not Modified) response by extending cache expiration.
+        # Servers may send updated validators with a 304 response.
+        log.info(f'Not modified: {cache_path}')
+        cache_data = self.load_cache(cache_path)
+        if cache_data is not None:
+            metadata = CacheMetadata(
+                self.get_expiration(headers, jitter_key=cache_path),
+                etag=headers.get('ETag') or metadata.etag,
+                last_modified=headers.get('Last-Modified') or metadata.last_modified,
+                content_type=metadata.content_type)
+            self.cache_store.update_metadata(cache_path, metadata)
+            self.memory_cache.put(cache_path, cache_data, metadata.expires)
+        return cache_data
+
     # === Required overrides.
 
     def on_process_download(self,
@@ -251,26 +850,45 @@ class JSONDataSource(DataSource):
                  *url_parts: str,
                  user_agent: str = None,
                  frequency: Interval = None,
-                 schema: Schema = None):
+                 schema: Schema = None,
+                 projection: List[str] = None,
+                 decoder: Callable[[Any], Any] = None):
         """
         Construct JSON data source.
 
         Cache frequency zero is only downloaded once and never replaced.
 
         The optional schema serves as a "poor man's" JSON schema for quickly
-        checking that all required parameters are present. It is a
-        potentially-nested collection of lists and dictionaries that map to the
-        structure of expected properties. Lists have only one element in the
-        schema, but the received data may have any quantity.
+        checking that all required parameters are present and have the right
+        types. See compile_schema() for details. It is compiled once, and is
+        checked against projected data, both when downloaded and when loaded
+        from the cache.
+
+        The optional projection is a list of dot-separated property paths, e.g.
+        "properties.temperature", to keep from downloaded data. Paths pass
+        through lists by applying to each list item. Only projected data is
+        returned and cached, in compact form.
+
+        The optional decoder converts checked data, e.g. to compact record
+        objects, when downloaded and when loaded from the cache. Only decoded
+        data is returned and kept in memory, but cache files still hold JSON.
+        Sources with the same URL and projection must use the same decoder,
+        because they share cache entries.
 
         :param name: data source name
         :param url: download URL, possibly including {<name>} template fields
         :param user_agent: optional user agent string
         :param frequency: update/cache frequency in seconds (default: not cached)
         :param schema: simple schema used to check for missing properties
+        :param projection: optional property paths to keep
+        :param decoder: optional function to convert checked data
         """
         super().__init__(name, *url_parts, user_agent=user_agent, frequency=frequency)
         self.schema = schema
+        self._validator = compile_schema(schema) if schema is not None else None
+        self.projection = projection
+        self._projection_tree = self._build_projection_tree(projection) if projection else None
+        self.decoder = decoder
 
     # === Required overrides.
 
@@ -284,21 +902,32 @@ class JSONDataSource(DataSource):
         :param data: raw data
         :param cache_path: future cache file path
         :return: returned bundle of massaged data and cache
-        :raise: I/O, JSON, or schema validation exception
+        :raise: I/O, JSON, schema validation, or decoder exception
         """
         json_data = json.loads(data)
-        self._check_schema(json_data, self.schema)
-        json_cache = json.dumps(json_data, indent=2)
+        if self._projection_tree is not None:
+            json_data = self._project(json_data, self._projection_tree)
+        if self._validator is not None:
+            self._validator(json_data)
+        json_cache = json.dumps(json_data, separators=(',', ':'))
+        if self.decoder is not None:
+            json_data = self.decoder(json_data)
         return DownloadResult(json_data, json_cache)
 
     def on_generate_cache_path(self, url: str, base_path: str) -> str:
         """
         Required override to generate a cache path based on a URL.
 
+        Projected data gets a distinct path, because it depends on the
+        projection as well as the URL.
+
         :param url: source URL
         :param base_path: base cache path
         :return: full cache file path
         """
+        if self.projection:
+            projection_hash = zlib.crc32('|'.join(self.projection).encode('utf-8'))
+            return f'{base_path}-{projection_hash:08x}.json'
         return f'{base_path}.json'
 
     def on_load_cache_file(self, path: str) -> Any:
@@ -309,10 +938,15 @@ class JSONDataSource(DataSource):
 
         :param path: cache file path
         :return: possibly-altered data or None if it fails to validate
-        :raise: I/O or JSON exception
+        :raise: I/O, JSON, schema validation, or decoder exception
         """
         with open(path, encoding='utf-8') as cache_file:
-            return json.load(cache_file)
+            json_data = json.load(cache_file)
+        if self._validator is not None:
+            self._validator(json_data)
+        if self.decoder is not None:
+            json_data = self.decoder(json_data)
+        return json_data
 
     def on_save_cache_file(self, path: str, data: Union[str, bytes]):
         """
@@ -329,25 +963,32 @@ class JSONDataSource(DataSource):
 
     # === Private methods.
 
+    @staticmethod
+    def _build_projection_tree(projection: List[str]) -> ProjectionTree:
+        tree: ProjectionTree = {}
+        for path in projection:
+            node = tree
+            names = path.split('.')
+            for name in names[:-1]:
+                # An existing empty node already keeps the entire value.
+                if name in node and not node[name]:
+                    break
+                node = node.setdefault(name, {})
+            else:
+                node[names[-1]] = {}
+        return tree
+
     @classmethod
-    def _check_schema(cls, data: Any, sub_schema: Optional[Schema]):
-        # Check list schema?
-        if isinstance(sub_schema, list):
-            if not isinstance(data, list):
-                raise ValueError(f'JSON data is not expected list type: {data}')
-            if len(sub_schema) != 1:
-                raise TypeError('More than one item in JSON data source schema list.')
-            for item_data in data:
-                cls._check_schema(item_data, sub_schema[0])
-            return
-        # Check dictionary schema?
-        if isinstance(sub_schema, dict):
-            for name, sub_schema in sub_schema.items():
-                if name not in data:
-                    raise ValueError(f'JSON data does not have expected'
-                                     f' "{name}" element: {data}')
-                # noinspection PyUnresolvedReferences
-                cls._check_schema(data[name], sub_schema)
+    def _project(cls, data: Any, tree: ProjectionTree) -> Any:
+        if not tree:
+            return data
+        if isinstance(data, list):
+            return [cls._project(item, tree) for item in data]
+        if isinstance(data, dict):
+            return {name: cls._project(data[name], sub_tree)
+                    for name, sub_tree in tree.items()
+                    if name in data}
+        return data
 
 
 class FileDataSource(DataSource):
@@ -432,7 +1073,14 @@ class FileDataSource(DataSource):
 
 
 class ImageDataSource(DataSource):
-    """Data source for image file downloads."""
+    """
+    Data source for images, decoded once and handed out as pixel buffers.
+
+    Downloads are decoded, and optionally resized, by the pillow library.
+    Cache files hold raw RGBA pixels, so that loading them after a restart
+    requires no decoding either. Without a cache frequency, no cache files are
+    written, e.g. when the consumer keeps its own copy, like an image atlas.
+    """
 
     def __init__(self,
                  name: str,
@@ -442,7 +1090,7 @@ class ImageDataSource(DataSource):
                  extension: str = None,
                  dimensions: Tuple[int, int] = None):
         """
-        Construct image file data source.
+        Construct image data source.
 
         Cache frequency zero is only downloaded once and never replaced.
 
@@ -453,7 +1101,7 @@ class ImageDataSource(DataSource):
         :param url: download URL, possibly including {<name>} template fields
         :param user_agent: optional user agent string
         :param frequency: update/cache frequency in seconds (default: not cached)
-        :param extension: optional file extension to append
+        :param extension: optional file extension to append before the raw image extension
         :param dimensions: optional target (width, height) dimensions
         """
         super().__init__(name, *url_parts, user_agent=user_agent, frequency=frequency)
@@ -467,14 +1115,21 @@ class ImageDataSource(DataSource):
         """
         Required override to check and massage downloaded data.
 
-        The cache path is the data that gets passed along.
+        The decoded and resized image data is passed along, and cached if
+        the data source has a cache frequency.
 
         :param data: raw data
         :param cache_path: future cache file path
         :return: returned bundle of massaged data and cache
         :raise: I/O or other exception
         """
-        return DownloadResult(cache_path, data)
+        pil_image = Image.open(BytesIO(data))
+        if self.dimensions:
+            log.info(f'Resize image for "{cache_path}" to'
+                     f' {self.dimensions[0]}x{self.dimensions[1]}.')
+            pil_image = pil_image.resize(self.dimensions)
+        image_data = ImageData.from_pil(pil_image)
+        return DownloadResult(image_data, image_data if self.frequency is not None else None)
 
     def on_generate_cache_path(self, url: str, base_path: str) -> str:
         """
@@ -484,38 +1139,26 @@ class ImageDataSource(DataSource):
         :param base_path: base cache path
         :return: full cache file path
         """
-        return f'{base_path}{self.extension}'
+        return f'{base_path}{self.extension}{RAW_IMAGE_EXTENSION}'
 
     def on_load_cache_file(self, path: str) -> Any:
         """
         Required override to load, check, and massage cached data.
 
-        The consumer of this class deals with reading the file.
-
         :param path: cache file path
-        :return: cache file path as data
-        :raise: I/O exception (won't happen here)
+        :return: image data
+        :raise: I/O exception or ValueError for a bad raw image file
         """
-        return path
+        return read_raw_image(path)
 
-    def on_save_cache_file(self, path: str, data: Union[str, bytes]):
+    def on_save_cache_file(self, path: str, data: ImageData):
         """
         Required override to save cache data.
 
         Caller handles exceptions.
 
         :param path: cache file path
-        :param data: data to save
+        :param data: image data to save
         :raise: I/O or other exception
         """
-        if self.dimensions:
-            # Use the PIL library to save a resized image.
-            # noinspection PyTypeChecker
-            pil_image = Image.open(BufferedRandom(BytesIO(data)))
-            log.info(f'Save image file "{path}" resized to'
-                     f' {self.dimensions[0]}x{self.dimensions[1]}.')
-            pil_resized_image = pil_image.resize(self.dimensions)
-            pil_resized_image.save(path)
-        else:
-            with open(path, 'wb') as cache_file:
-                return cache_file.write(data)
+        write_raw_image(path, data)
@@ -0,0 +1,204 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Data source cache and network metrics."""
+
+import threading
+from copy import deepcopy
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+# Latency histogram bucket upper bounds in milliseconds. The last bucket is unbounded.
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+@dataclass
+class LatencyHistogram:
+    """Latency histogram with fixed buckets."""
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    """Sample counts by bucket, with an extra bucket for larger values."""
+    total: float = 0
+    """Sum of all samples in seconds."""
+    maximum: float = 0
+    """Largest sample in seconds."""
+
+    @property
+    def count(self) -> int:
+        """
+        Sample count property.
+
+        :return: number of samples
+        """
+        return sum(self.counts)
+
+    def add(self, seconds: float):
+        """
+        Add a sample.
+
+        :param seconds: latency in seconds
+        """
+        milliseconds = seconds * 1000
+        bucket_idx = 0
+        while bucket_idx < len(LATENCY_BUCKETS_MS) and milliseconds > LATENCY_BUCKETS_MS[bucket_idx]:
+            bucket_idx += 1
+        self.counts[bucket_idx] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Estimate a percentile by its bucket's upper bound.
+
+        :param percentile: percentile from 0 to 100
+        :return: latency upper bound in milliseconds, or the maximum for the last bucket
+        """
+        count = self.count
+        if count == 0:
+            return 0
+        threshold = count * percentile / 100
+        running_count = 0
+        for bucket_idx, bucket_count in enumerate(self.counts):
+            running_count += bucket_count
+            if running_count >= threshold and bucket_count:
+                if bucket_idx < len(LATENCY_BUCKETS_MS):
+                    return LATENCY_BUCKETS_MS[bucket_idx]
+                break
+        return self.maximum * 1000
+
+    def format(self) -> str:
+        """
+        Summarize the histogram for logging.
+
+        :return: summary text
+        """
+        count = self.count
+        if count == 0:
+            return 'n=0'
+        return (f'n={count}'
+                f' avg={self.total * 1000 / count:.1f}ms'
+                f' p50<={self.get_percentile(50):.0f}ms'
+                f' p95<={self.get_percentile(95):.0f}ms'
+                f' max={self.maximum * 1000:.0f}ms')
+
+
+@dataclass
+class DataSourceMetrics:
+    """Counters and histograms for one data source."""
+    coalesced: int = 0
+    """Requests that shared the result of a concurrent or same-tick request."""
+    memory_hits: int = 0
+    """Requests served from the in-memory cache."""
+    disk_hits: int = 0
+    """Requests served from unexpired cache files."""
+    stale_hits: int = 0
+    """Requests served from expired cache files while rate limited or offline."""
+    fetches: int = 0
+    """Network requests that received a response."""
+    not_modified: int = 0
+    """Conditional requests answered with 304 (Not Modified)."""
+    failures: int = 0
+    """Requests that returned no data."""
+    bytes_in: int = 0
+    """Response body bytes received, before decompression."""
+    fetch_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    """Network request latency, including reading the response body."""
+    parse_time: LatencyHistogram = field(default_factory=LatencyHistogram)
+    """Time spent processing downloaded data or loading cache files."""
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        Cache hit ratio property, counting 304 responses as hits.
+
+        :return: hit ratio from 0 to 1
+        """
+        cache_hits = self.coalesced + self.memory_hits + self.disk_hits + self.stale_hits
+        requests = cache_hits + self.fetches + self.failures
+        hits = cache_hits + self.not_modified
+        return hits / requests if requests else 0
+
+    def format(self) -> str:
+        """
+        Summarize metrics for logging.
+
+        :return: summary text
+        """
+        return (f'hit_ratio={self.hit_ratio:.2f}'
+                f' coalesced={self.coalesced}'
+                f' memory={self.memory_hits}'
+                f' disk={self.disk_hits}'
+                f' stale={self.stale_hits}'
+                f' fetch={self.fetches}'
+                f' 304={self.not_modified}'
+                f' fail={self.failures}'
+                f' bytes_in={self.bytes_in}'
+                f' latency[{self.fetch_latency.format()}]'
+                f' parse[{self.parse_time.format()}]')
+
+
+class MetricsRegistry:
+    """Thread-safe data source metrics by source name."""
+
+    def __init__(self):
+        """Metrics registry constructor."""
+        self._metrics: Dict[str, DataSourceMetrics] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, counter: str, amount: int = 1):
+        """
+        Increment a counter.
+
+        :param name: data source name
+        :param counter: DataSourceMetrics counter attribute name
+        :param amount: amount to add
+        """
+        with self._lock:
+            metrics = self._get(name)
+            setattr(metrics, counter, getattr(metrics, counter) + amount)
+
+    def time(self, name: str, histogram: str, seconds: float):
+        """
+        Add a histogram sample.
+
+        :param name: data source name
+        :param histogram: DataSourceMetrics histogram attribute name
+        :param seconds: sample in seconds
+        """
+        with self._lock:
+            getattr(self._get(name), histogram).add(seconds)
+
+    def get_snapshot(self) -> Dict[str, DataSourceMetrics]:
+        """
+        Copy current metrics.
+
+        :return: metrics by data source name
+        """
+        with self._lock:
+            return deepcopy(self._metrics)
+
+    def clear(self):
+        """Reset all metrics."""
+        with self._lock:
+            self._metrics.clear()
+
+    def _get(self, name: str) -> DataSourceMetrics:
+        # Caller must hold the lock.
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            metrics = DataSourceMetrics()
+            self._metrics[name] = metrics
+        return metrics
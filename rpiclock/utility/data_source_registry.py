@@ -0,0 +1,72 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Process-wide registry of shared data sources."""
+
+import threading
+from typing import Any, Dict, Hashable, Type, TypeVar
+
+from .data_source import DataSource
+
+DataSourceType = TypeVar('DataSourceType', bound=DataSource)
+
+
+def _make_hashable(value: Any) -> Hashable:
+    # Convert nested dictionaries and lists, e.g. schemas, to hashable keys.
+    if isinstance(value, dict):
+        return tuple(sorted((key, _make_hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_make_hashable(item) for item in value)
+    return value
+
+
+class DataSourceRegistry:
+    """
+    Hands out data sources shared by all consumers with the same parameters.
+
+    Panels that need the same data, e.g. several weather panels, should get
+    their data sources here rather than constructing them directly.
+    """
+
+    sources: Dict[Hashable, DataSource] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls,
+            source_class: Type[DataSourceType],
+            name: str,
+            *url_parts: str,
+            **kwargs) -> DataSourceType:
+        """
+        Get or create a shared data source.
+
+        Sources are keyed by class, URL template parts, and keyword parameters.
+        The name is only used when the source is first created.
+
+        :param source_class: DataSource sub-class
+        :param name: data source name
+        :param url_parts: URL template parts
+        :param kwargs: keyword parameters for the data source constructor
+        :return: shared data source instance
+        """
+        key = (source_class, url_parts, _make_hashable(kwargs))
+        with cls._lock:
+            source = cls.sources.get(key)
+            if source is None:
+                source = source_class(name, *url_parts, **kwargs)
+                cls.sources[key] = source
+            return source
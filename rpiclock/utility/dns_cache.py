@@ -0,0 +1,198 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Host name resolution cache with background refresh."""
+
+import ipaddress
+import socket
+import threading
+from dataclasses import dataclass
+from time import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .connectivity import ConnectivityMonitor
+from .logger import log
+from .prefetch_scheduler import PrefetchScheduler
+
+DEFAULT_DNS_TTL = 300.0
+# Limits applied to the configured TTL.
+DNS_TTL_FLOOR = 30.0
+DNS_TTL_CEILING = 3600.0
+# Entries are refreshed this long before they expire.
+DNS_REFRESH_LEAD = 10.0
+# Entries are no longer refreshed after this long without lookups.
+DNS_IDLE_TIMEOUT = 3600.0
+
+# getaddrinfo() result items: (family, type, proto, canonname, sockaddr).
+AddressInfo = Tuple[int, int, int, str, Any]
+
+
+@dataclass
+class DNSCacheEntry:
+    """Cached host name resolution."""
+    addresses: List[AddressInfo]
+    """getaddrinfo() results."""
+    expires: float
+    """Expiration time."""
+
+
+class DNSCache:
+    """
+    Thread-safe cache of getaddrinfo() results by host and port.
+
+    getaddrinfo() does not report record TTLs, so entries use the configured
+    TTL, limited by a floor and a ceiling. Entries in use are refreshed in the
+    background before they expire, so that lookups only block the first time
+    a host is resolved, or after it was idle. Expired addresses are still
+    used if a refresh fails.
+
+    Background refreshes are postponed while the connectivity monitor, if
+    provided, reports that the host is unreachable. Failed refreshes are
+    retried with the refresh scheduler's backoff.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_DNS_TTL, connectivity: ConnectivityMonitor = None):
+        """
+        DNS cache constructor.
+
+        :param ttl: seconds to keep resolved addresses, limited by DNS_TTL_FLOOR and DNS_TTL_CEILING
+        :param connectivity: optional connectivity monitor for skipping doomed refreshes
+        """
+        self.ttl = ttl
+        self.connectivity = connectivity
+        self._entries: Dict[Tuple[str, int], DNSCacheEntry] = {}
+        self._lock = threading.Lock()
+        self._refresh_scheduler = PrefetchScheduler(lead=DNS_REFRESH_LEAD,
+                                                    idle_timeout=DNS_IDLE_TIMEOUT,
+                                                    name='dns-refresh')
+
+    def get_ttl(self) -> float:
+        """
+        Get the effective TTL.
+
+        :return: TTL in seconds
+        """
+        return min(max(self.ttl, DNS_TTL_FLOOR), DNS_TTL_CEILING)
+
+    def get_cached(self, host: str, port: int) -> Optional[List[AddressInfo]]:
+        """
+        Get cached addresses without blocking, e.g. for asyncio callers.
+
+        :param host: host name
+        :param port: port number
+        :return: addresses or None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is None or entry.expires <= time():
+            return None
+        self._demand(host, port, entry)
+        return entry.addresses
+
+    def resolve(self, host: str, port: int) -> List[AddressInfo]:
+        """
+        Resolve a host name, using cached addresses when possible.
+
+        :param host: host name or IP address
+        :param port: port number
+        :return: getaddrinfo() results for stream sockets
+        :raise: socket.gaierror if there are no usable addresses
+        """
+        if _is_ip_address(host):
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is None or entry.expires <= time():
+            try:
+                entry = self._lookup(host, port)
+            except OSError as exc:
+                if entry is None:
+                    raise
+                log.warning(f'Using expired addresses for "{host}" after lookup error: {exc}')
+        self._demand(host, port, entry)
+        return entry.addresses
+
+    def stop(self):
+        """Stop background refreshes."""
+        self._refresh_scheduler.stop()
+
+    def _demand(self, host: str, port: int, entry: DNSCacheEntry):
+        self._refresh_scheduler.demand(f'{host}:{port}',
+                                       entry.expires,
+                                       lambda: self._refresh(host, port))
+
+    def _refresh(self, host: str, port: int) -> Optional[float]:
+        # Called by the refresh scheduler thread. Returns the new expiration time.
+        if self.connectivity is not None:
+            if not self.connectivity.is_reachable(host):
+                return None
+            try:
+                return self._lookup(host, port).expires
+            except OSError as exc:
+                self.connectivity.record_failure(host, exc)
+                raise
+        return self._lookup(host, port).expires
+
+    def _lookup(self, host: str, port: int) -> DNSCacheEntry:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        entry = DNSCacheEntry(addresses, time() + self.get_ttl())
+        with self._lock:
+            self._entries[(host, port)] = entry
+        return entry
+
+
+def create_connection(dns_cache: DNSCache,
+                      address: Tuple[str, int],
+                      timeout: Any = None,
+                      source_address: Tuple[str, int] = None,
+                      ) -> socket.socket:
+    """
+    socket.create_connection() equivalent that resolves through a DNS cache.
+
+    :param dns_cache: DNS cache
+    :param address: (host, port) tuple
+    :param timeout: optional socket timeout in seconds
+    :param source_address: optional (host, port) to bind before connecting
+    :return: connected socket
+    :raise: OSError from the last address tried
+    """
+    host, port = address
+    error: Optional[OSError] = None
+    for family, socket_type, proto, _canonical_name, socket_address in dns_cache.resolve(host, port):
+        sock: Optional[socket.socket] = None
+        try:
+            sock = socket.socket(family, socket_type, proto)
+            # http.client passes a sentinel object for the default timeout.
+            if isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(socket_address)
+            return sock
+        except OSError as exc:
+            error = exc
+            if sock is not None:
+                sock.close()
+    raise error if error is not None else OSError(f'No addresses for "{host}".')
+
+
+def _is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,94 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+"""Long-lived asyncio event loop in a background thread."""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Coroutine, Optional
+
+from .logger import log
+
+
+class EventLoopThread:
+    """
+    Runs coroutines on one asyncio event loop in a background thread.
+
+    Callers on other threads, e.g. the main loop, submit coroutines and poll
+    the returned futures, so that they never wait for network I/O. Using one
+    loop for the life of the process lets loop-bound resources, e.g. fetch
+    semaphores and idle connections, be shared by all coroutines.
+    """
+
+    def __init__(self, name: str = 'event-loop'):
+        """
+        Event loop thread constructor.
+
+        The thread is started on first submission.
+
+        :param name: thread name
+        """
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, coroutine: Coroutine) -> Future:
+        """
+        Schedule a coroutine on the event loop.
+
+        :param coroutine: coroutine to run
+        :return: thread-safe future that receives the result or exception
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop())
+
+    def stop(self):
+        """Stop the event loop, cancelling remaining tasks, and wait for the thread."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run,
+                                                args=(self._loop,),
+                                                name=self.name,
+                                                daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def _run(self, loop: asyncio.AbstractEventLoop):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        # noinspection PyBroadException
+        except Exception as exc:
+            log.error(f'Event loop "{self.name}" failed: {exc}')
+        finally:
+            loop.close()
@@ -0,0 +1,187 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Pre-resized image tiles combined in a single cached image file."""
+
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from .cache_store import CacheStore, CacheMetadata
+from .image_data import ImageData
+from .logger import log
+from .rect import Rect
+
+DEFAULT_ATLAS_COLUMNS = 8
+# PNG text chunk key for the JSON list of tile keys.
+TILE_KEYS_TEXT_KEY = 'rpiclock-tile-keys'
+
+
+class ImageAtlas:
+    """
+    Equally-sized image tiles, identified by keys, in one PNG cache file.
+
+    Images are resized once, when added, so that displaying a tile only
+    requires the atlas image data and the tile's source rectangle. The tile
+    keys are stored in the PNG file, and the file never expires. The file is
+    only decoded when first loaded, and only the decoded image data is kept.
+    """
+
+    def __init__(self,
+                 cache_store: CacheStore,
+                 name: str,
+                 tile_size: Tuple[int, int],
+                 columns: int = DEFAULT_ATLAS_COLUMNS):
+        """
+        Image atlas constructor.
+
+        The atlas file is loaded on first use.
+
+        :param cache_store: cache store that holds the atlas file
+        :param name: atlas file name, which should include the tile size
+        :param tile_size: (width, height) tile dimensions
+        :param columns: tiles per row
+        """
+        self.cache_store = cache_store
+        self.path = cache_store.get_path(name)
+        self.tile_size = tile_size
+        self.columns = columns
+        self._image_data: Optional[ImageData] = None
+        self._keys: Optional[List[str]] = None
+        self._indexes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get_tile(self, key: str) -> Optional[Rect]:
+        """
+        Look up a tile's source rectangle in the atlas file.
+
+        :param key: tile key
+        :return: source rectangle or None if the tile is missing
+        """
+        with self._lock:
+            self._load()
+            index = self._indexes.get(key)
+            if index is None:
+                return None
+            # Keep the atlas file from being evicted from the cache.
+            self.cache_store.touch(self.path)
+            return self._get_tile_rect(index)
+
+    def get_image_data(self) -> Optional[ImageData]:
+        """
+        Get the decoded atlas image.
+
+        The same image data is returned until tiles are added.
+
+        :return: atlas image data or None if there are no tiles
+        """
+        with self._lock:
+            self._load()
+            return self._image_data
+
+    def get_missing_keys(self, keys: List[str]) -> List[str]:
+        """
+        Filter keys for tiles that are not in the atlas.
+
+        :param keys: tile keys to check
+        :return: keys for missing tiles
+        """
+        with self._lock:
+            self._load()
+            return [key for key in keys if key not in self._indexes]
+
+    def add(self, images: Dict[str, ImageData]) -> bool:
+        """
+        Add images to the atlas file, resizing them if necessary.
+
+        Images that are already in the atlas are ignored, and images that fail
+        to convert are logged and skipped. The file is written once for all
+        the images.
+
+        :param images: decoded image data by tile key, ideally already tile-sized
+        :return: True if the atlas file was written successfully
+        """
+        with self._lock:
+            self._load()
+            tiles: Dict[str, Image.Image] = {}
+            for key, data in images.items():
+                if key in self._indexes or key in tiles:
+                    continue
+                # noinspection PyBroadException
+                try:
+                    tile = Image.frombuffer('RGBA', (data.width, data.height), data.pixels, 'raw', 'RGBA', 0, 1)
+                    if tile.size != self.tile_size:
+                        tile = tile.resize(self.tile_size)
+                    tiles[key] = tile
+                except Exception as exc:
+                    log.error(f'Failed to convert image "{key}" for atlas "{self.path}": {exc}')
+            if not tiles:
+                return False
+            keys = self._keys + list(tiles.keys())
+            rows = (len(keys) + self.columns - 1) // self.columns
+            image = Image.new('RGBA', (self.columns * self.tile_size[0], rows * self.tile_size[1]))
+            if self._image_data is not None:
+                image.paste(Image.frombuffer('RGBA',
+                                            (self._image_data.width, self._image_data.height),
+                                            self._image_data.pixels,
+                                            'raw', 'RGBA', 0, 1),
+                            (0, 0))
+            for index, key in enumerate(keys[len(self._keys):], start=len(self._keys)):
+                tile_rect = self._get_tile_rect(index)
+                image.paste(tiles[key], (tile_rect.left, tile_rect.top))
+            png_info = PngInfo()
+            png_info.add_text(TILE_KEYS_TEXT_KEY, json.dumps(keys))
+            try:
+                log.info(f'Save image atlas "{self.path}" with {len(keys)} tiles.')
+                self.cache_store.write(self.path,
+                                       lambda path: image.save(path, format='PNG', pnginfo=png_info),
+                                       CacheMetadata(None))
+            except Exception as exc:
+                log.error(f'Failed to save image atlas "{self.path}": {exc}')
+                return False
+            self._image_data = ImageData.from_pil(image)
+            self._keys = keys
+            self._indexes = {key: index for index, key in enumerate(keys)}
+            return True
+
+    def _get_tile_rect(self, index: int) -> Rect:
+        width, height = self.tile_size
+        return Rect((index % self.columns) * width, (index // self.columns) * height, width, height)
+
+    def _load(self):
+        # Caller must hold the lock.
+        if self._keys is not None:
+            return
+        self._keys = []
+        if self.cache_store.get_metadata(self.path) is None:
+            return
+        # noinspection PyBroadException
+        try:
+            with Image.open(self.path) as image:
+                keys = json.loads(image.info[TILE_KEYS_TEXT_KEY])
+                if image.width != self.columns * self.tile_size[0]:
+                    raise ValueError(f'unexpected width {image.width}')
+                self._image_data = ImageData.from_pil(image)
+            self._keys = keys
+            self._indexes = {key: index for index, key in enumerate(keys)}
+        except Exception as exc:
+            log.error(f'Discarding bad image atlas "{self.path}": {exc}')
+            self._image_data = None
+            self.cache_store.remove(self.path)
@@ -0,0 +1,91 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Decoded RGBA pixel buffers and their raw file format."""
+
+import os
+import struct
+from dataclasses import dataclass
+from typing import Union
+
+from PIL import Image
+
+RAW_IMAGE_EXTENSION = '.rgba'
+# Raw image file header: magic, width, and height.
+RAW_IMAGE_HEADER = struct.Struct('>4sII')
+RAW_IMAGE_MAGIC = b'RGBA'
+
+
+# Identity comparison keeps instances hashable, e.g. for display surface caching.
+@dataclass(eq=False)
+class ImageData:
+    """Decoded image with 8-bit RGBA pixels."""
+    width: int
+    """Width in pixels."""
+    height: int
+    """Height in pixels."""
+    pixels: Union[bytes, memoryview]
+    """Row-major RGBA pixel data."""
+
+    @classmethod
+    def from_pil(cls, image: Image.Image) -> 'ImageData':
+        """
+        Convert a PIL image.
+
+        :param image: PIL image
+        :return: image data
+        """
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        return cls(image.width, image.height, image.tobytes())
+
+
+def write_raw_image(path: str, image_data: ImageData):
+    """
+    Write image data to a raw file that loads without decoding.
+
+    :param path: file path
+    :param image_data: image data
+    :raise: I/O exception
+    """
+    with open(path, 'wb') as raw_file:
+        raw_file.write(RAW_IMAGE_HEADER.pack(RAW_IMAGE_MAGIC, image_data.width, image_data.height))
+        raw_file.write(image_data.pixels)
+
+
+def read_raw_image(path: str) -> ImageData:
+    """
+    Read image data from a raw file.
+
+    The pixels are a view into the file data, rather than a copy.
+
+    :param path: file path
+    :return: image data
+    :raise: I/O exception or ValueError if the file is not a valid raw image
+    """
+    buffer = bytearray(os.path.getsize(path))
+    with open(path, 'rb') as raw_file:
+        if raw_file.readinto(buffer) != len(buffer):
+            raise ValueError('raw image file is truncated')
+    if len(buffer) < RAW_IMAGE_HEADER.size:
+        raise ValueError('raw image file is too small')
+    magic, width, height = RAW_IMAGE_HEADER.unpack_from(buffer)
+    if magic != RAW_IMAGE_MAGIC:
+        raise ValueError('not a raw image file')
+    if len(buffer) != RAW_IMAGE_HEADER.size + width * height * 4:
+        raise ValueError(f'raw image file size does not match {width}x{height} pixels')
+    return ImageData(width, height, memoryview(buffer)[RAW_IMAGE_HEADER.size:])
@@ -0,0 +1,72 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Deterministic per-device jitter for spreading out fleet request schedules."""
+
+import hashlib
+import socket
+
+DEFAULT_JITTER = 0.1
+# Offsets are derived from this many leading bytes of the digest.
+OFFSET_BYTES = 8
+
+
+class Jitter:
+    """
+    Per-device schedule jitter, seeded by the host name by default.
+
+    Clocks that boot together with NTP-aligned time would otherwise refresh
+    caches and poll in lock step. Each device shortens intervals by its own
+    fixed fraction, so that a fleet spreads its requests over the jitter
+    range. Intervals are only ever shortened, which keeps cache lifetimes
+    within what servers allow.
+
+    Offsets are stable across restarts, and differ between keys, e.g. cache
+    paths, so that one device's requests are also spread out.
+    """
+
+    def __init__(self, fraction: float = DEFAULT_JITTER, seed: str = None):
+        """
+        Jitter constructor.
+
+        :param fraction: maximum fraction of an interval to subtract, 0 to disable
+        :param seed: device seed (default: host name)
+        """
+        self.fraction = fraction
+        self.seed = seed if seed is not None else socket.gethostname()
+
+    def get_offset(self, key: str) -> float:
+        """
+        Get this device's fixed offset for a key.
+
+        :param key: schedule key, e.g. a cache path or poller name
+        :return: offset from 0 (inclusive) to 1 (exclusive)
+        """
+        digest = hashlib.sha1(f'{self.seed}:{key}'.encode()).digest()
+        return int.from_bytes(digest[:OFFSET_BYTES], 'big') / (1 << (OFFSET_BYTES * 8))
+
+    def apply(self, interval: float, key: str) -> float:
+        """
+        Shorten an interval by this device's jitter for a key.
+
+        :param interval: interval in seconds
+        :param key: schedule key, e.g. a cache path or poller name
+        :return: jittered interval in seconds
+        """
+        if self.fraction <= 0 or interval <= 0:
+            return interval
+        return interval * (1 - min(self.fraction, 1) * self.get_offset(key))
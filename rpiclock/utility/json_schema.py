@@ -0,0 +1,140 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compiled "poor man's" JSON schema validation."""
+
+from typing import Any, Callable, Dict, List, Union
+
+Schema = Union[Dict[str, Union[type, 'Schema']], List['Schema'], type, None]
+SchemaValidator = Callable[[Any], None]
+
+_Check = Callable[[Any], None]
+
+
+class SchemaError(ValueError):
+    """JSON data does not match the schema."""
+
+    def __init__(self, problem: str):
+        """
+        Schema error constructor.
+
+        :param problem: problem description
+        """
+        super().__init__(problem)
+        self.problem = problem
+        self.path: List[Union[str, int]] = []
+
+    def __str__(self) -> str:
+        """
+        Error message with the failing path, e.g. "properties.items[3]".
+
+        :return: message text
+        """
+        path_text = ''
+        for part in self.path:
+            if isinstance(part, int):
+                path_text += f'[{part}]'
+            else:
+                path_text += f'.{part}' if path_text else part
+        return f'JSON data "{path_text or "(root)"}" {self.problem}'
+
+
+def compile_schema(schema: Schema) -> SchemaValidator:
+    """
+    Compile a schema into a validator function.
+
+    A schema is a potentially-nested collection of lists and dictionaries that
+    map to the structure of expected properties. Lists have zero or one
+    element, which is the schema for every item in the received data. Leaves
+    are types to check, or None to only require presence. A float leaf also
+    accepts integers.
+
+    The schema structure is only walked once, here, to build the validator.
+    Validation builds the failing path only when it fails.
+
+    :param schema: schema to compile
+    :return: validator function that raises SchemaError when data doesn't match
+    :raise TypeError: if the schema is malformed
+    """
+    return _compile(schema)
+
+
+def _compile(schema: Schema) -> _Check:
+    if schema is None:
+        return _check_nothing
+    if isinstance(schema, list):
+        return _compile_list(schema)
+    if isinstance(schema, dict):
+        return _compile_dict(schema)
+    if isinstance(schema, type):
+        return _compile_type(schema)
+    raise TypeError(f'Bad JSON schema element: {schema!r}')
+
+
+def _check_nothing(_data: Any):
+    pass
+
+
+def _compile_list(schema: list) -> _Check:
+    if len(schema) > 1:
+        raise TypeError('More than one item in JSON schema list.')
+    item_check = _compile(schema[0]) if schema else None
+
+    def _check_list(data: Any):
+        if not isinstance(data, list):
+            raise SchemaError('is not a list')
+        if item_check is not None:
+            for item_idx, item_data in enumerate(data):
+                try:
+                    item_check(item_data)
+                except SchemaError as exc:
+                    exc.path.insert(0, item_idx)
+                    raise
+
+    return _check_list
+
+
+def _compile_dict(schema: dict) -> _Check:
+    checks = tuple((name, _compile(sub_schema)) for name, sub_schema in schema.items())
+
+    def _check_dict(data: Any):
+        if not isinstance(data, dict):
+            raise SchemaError('is not an object')
+        for name, check in checks:
+            if name not in data:
+                exc = SchemaError('is missing')
+                exc.path.append(name)
+                raise exc
+            try:
+                check(data[name])
+            except SchemaError as exc:
+                exc.path.insert(0, name)
+                raise
+
+    return _check_dict
+
+
+def _compile_type(schema: type) -> _Check:
+    expected_types = (int, float) if schema is float else schema
+
+    def _check_type(data: Any):
+        # JSON booleans are Python integers, but are not valid numbers here.
+        if (not isinstance(data, expected_types)
+                or (isinstance(data, bool) and schema is not bool)):
+            raise SchemaError(f'is not of type {schema.__name__}')
+
+    return _check_type
@@ -0,0 +1,100 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""In-memory LRU cache with expiration."""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import time
+from typing import Any, Optional
+
+DEFAULT_MAX_ENTRIES = 64
+
+
+@dataclass
+class MemoryCacheEntry:
+    """In-memory cache entry."""
+    data: Any
+    """Cached (parsed) data."""
+    expires: Optional[float]
+    """Expiration time, or None if it never expires."""
+
+
+class MemoryCache:
+    """
+    Thread-safe in-memory LRU cache with per-entry expiration.
+
+    The least recently used entry is discarded when the cache is full.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Memory cache constructor.
+
+        :param max_entries: maximum number of entries to keep
+        """
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, MemoryCacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get unexpired data and mark it as recently used.
+
+        Expired entries are discarded.
+
+        :param key: cache key
+        :return: data or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires is not None and time() >= entry.expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry.data
+
+    def put(self, key: str, data: Any, expires: Optional[float]):
+        """
+        Add or replace data.
+
+        :param key: cache key
+        :param data: data to cache
+        :param expires: expiration time, or None if it never expires
+        """
+        with self._lock:
+            self._entries[key] = MemoryCacheEntry(data, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remove(self, key: str):
+        """
+        Remove data if present.
+
+        :param key: cache key
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all data."""
+        with self._lock:
+            self._entries.clear()
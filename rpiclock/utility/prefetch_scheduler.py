@@ -0,0 +1,210 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Background refresh of cached data shortly before it expires."""
+
+import threading
+from dataclasses import dataclass
+from time import time
+from typing import Callable, Dict, List, Optional
+
+from .logger import log
+
+DEFAULT_PREFETCH_LEAD = 15.0
+DEFAULT_PREFETCH_IDLE_TIMEOUT = 3600.0
+# Failed refreshes are retried with exponential backoff.
+PREFETCH_RETRY_INTERVAL = 10.0
+PREFETCH_RETRY_INTERVAL_MAX = 600.0
+
+# Refresh function that returns the new expiration time, if known.
+RefreshFunction = Callable[[], Optional[float]]
+
+
+@dataclass
+class PrefetchEntry:
+    """Tracked cache entry."""
+    refresh: RefreshFunction
+    """Function that refreshes the cache entry."""
+    expires: float
+    """Expiration time."""
+    demand_time: float
+    """Last time the data was requested by a consumer, for prioritization."""
+    retry_time: float = 0
+    """Earliest retry time after a refresh that failed to extend expiration."""
+    failures: int = 0
+    """Consecutive failed refreshes, for retry backoff."""
+
+    def get_due_time(self, lead: float) -> float:
+        """
+        Calculate when the entry should be refreshed.
+
+        :param lead: seconds before expiration to refresh
+        :return: refresh time
+        """
+        return max(self.expires - lead, self.retry_time)
+
+
+class PrefetchScheduler:
+    """
+    Refreshes cache entries in a background thread before they expire.
+
+    Consumers report each request with demand(), which (re)schedules the
+    entry. Due entries are refreshed most recently demanded first, so that
+    data displayed by the active screen is refreshed before anything else.
+    Entries that have not been demanded within the idle timeout, e.g. for
+    panels on a screen that is no longer shown, are dropped.
+
+    Data with a lifetime no longer than the lead, e.g. due to a small max-age
+    or no-cache, can't be refreshed ahead of expiration. It is not tracked,
+    and consumers fetch it on demand. Failed refreshes are retried with
+    exponential backoff.
+    """
+
+    def __init__(self,
+                 lead: float = DEFAULT_PREFETCH_LEAD,
+                 idle_timeout: float = DEFAULT_PREFETCH_IDLE_TIMEOUT,
+                 name: str = 'prefetch'):
+        """
+        Prefetch scheduler constructor.
+
+        The thread is started on first demand.
+
+        :param lead: seconds before expiration to refresh
+        :param idle_timeout: seconds without demand before an entry is dropped
+        :param name: thread name
+        """
+        self.lead = lead
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self._entries: Dict[str, PrefetchEntry] = {}
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def demand(self, key: str, expires: Optional[float], refresh: RefreshFunction):
+        """
+        Record a request for cached data and schedule its refresh.
+
+        :param key: cache entry key
+        :param expires: expiration time, or None if it never expires
+        :param refresh: function that refreshes the entry and returns the new expiration
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            if expires is None:
+                self._entries.pop(key, None)
+                return
+            entry = self._entries.get(key)
+            if entry is None:
+                if expires - self.lead <= time():
+                    return
+                self._entries[key] = PrefetchEntry(refresh, expires, time())
+            else:
+                entry.refresh = refresh
+                entry.expires = max(entry.expires, expires)
+                entry.demand_time = time()
+            self._start()
+            self._condition.notify()
+
+    def defer(self, key: str, expires: Optional[float], refresh: RefreshFunction):
+        """
+        Refresh an entry in the background as soon as possible.
+
+        Used for requests that couldn't be sent right away by a thread that
+        must not wait, e.g. due to rate limiting. An entry that is already
+        tracked keeps its schedule, including any retry backoff.
+
+        :param key: cache entry key
+        :param expires: current expiration time, or None if nothing is cached
+        :param refresh: function that refreshes the entry and returns the new expiration
+        """
+        with self._condition:
+            if self._stopped:
+                return
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = PrefetchEntry(refresh, expires or 0, time())
+            else:
+                entry.refresh = refresh
+                entry.demand_time = time()
+            self._start()
+            self._condition.notify()
+
+    def stop(self):
+        """Stop the background thread and forget all entries."""
+        with self._condition:
+            self._stopped = True
+            self._entries.clear()
+            self._condition.notify()
+
+    def _start(self):
+        # Caller must hold the condition lock.
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name=self.name,
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            due_entries = self._wait_for_due_entries()
+            if due_entries is None:
+                return
+            for key, entry in due_entries:
+                # noinspection PyBroadException
+                try:
+                    expires = entry.refresh()
+                except Exception as exc:
+                    log.error(f'{self.name.capitalize()} failed for "{key}": {exc}')
+                    expires = None
+                now = time()
+                with self._condition:
+                    if expires is None or expires <= entry.expires:
+                        # Not refreshed, e.g. due to a network error or rate limiting.
+                        entry.failures += 1
+                        entry.retry_time = now + min(PREFETCH_RETRY_INTERVAL * 2 ** (entry.failures - 1),
+                                                     PREFETCH_RETRY_INTERVAL_MAX)
+                    elif expires - self.lead <= now:
+                        # Refreshed, but the new lifetime is too short to refresh ahead of expiration.
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                    else:
+                        entry.failures = 0
+                        entry.expires = expires
+
+    def _wait_for_due_entries(self) -> Optional[List]:
+        # Returns (key, entry) pairs, most recently demanded first, or None to stop.
+        with self._condition:
+            while not self._stopped:
+                now = time()
+                for key in [key for key, entry in self._entries.items()
+                            if now - entry.demand_time > self.idle_timeout]:
+                    log.info(f'Stop {self.name} of idle entry: {key}')
+                    del self._entries[key]
+                due_entries = [(key, entry) for key, entry in self._entries.items()
+                               if entry.get_due_time(self.lead) <= now]
+                if due_entries:
+                    due_entries.sort(key=lambda item: item[1].demand_time, reverse=True)
+                    return due_entries
+                if self._entries:
+                    timeout = min(entry.get_due_time(self.lead)
+                                  for entry in self._entries.values()) - now
+                else:
+                    timeout = None
+                self._condition.wait(timeout)
+            return None
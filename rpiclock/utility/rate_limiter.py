@@ -0,0 +1,116 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Per-host token bucket rate limiting for outbound requests."""
+
+import threading
+from time import sleep, time
+from typing import Dict, Optional
+
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 4
+DEFAULT_MAX_WAIT = 2.0
+
+
+class TokenBucket:
+    """
+    Token bucket that allows short bursts and a sustained request rate.
+
+    Requests reserve tokens in arrival order. The balance may go negative,
+    which represents the queue of callers waiting for their turn.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Token bucket constructor.
+
+        :param rate: tokens added per second
+        :param burst: maximum tokens, i.e. the largest burst allowed
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.update_time = time()
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Reserve a token if it becomes available soon enough.
+
+        Caller must serialize access.
+
+        :param max_wait: maximum acceptable wait in seconds
+        :return: wait in seconds before using the token, or None if over budget
+        """
+        now = time()
+        self.tokens = min(self.tokens + (now - self.update_time) * self.rate, self.burst)
+        self.update_time = now
+        wait = max(1 - self.tokens, 0) / self.rate
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class RateLimiter:
+    """Thread-safe token buckets for each host."""
+
+    def __init__(self,
+                 rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST,
+                 max_wait: float = DEFAULT_MAX_WAIT):
+        """
+        Rate limiter constructor.
+
+        :param rate: sustained requests per second for each host
+        :param burst: maximum requests in a burst for each host
+        :param max_wait: default maximum seconds to wait for a turn
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, host: str, max_wait: float = None) -> Optional[float]:
+        """
+        Reserve a turn to send a request to a host, without waiting.
+
+        :param host: host name, possibly with a port
+        :param max_wait: maximum seconds to wait, or None for the default
+        :return: seconds to wait before sending, or None if over budget
+        """
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[host] = bucket
+            return bucket.reserve(self.max_wait if max_wait is None else max_wait)
+
+    def acquire(self, host: str, max_wait: float = None) -> bool:
+        """
+        Wait for a turn to send a request to a host.
+
+        :param host: host name, possibly with a port
+        :param max_wait: maximum seconds to wait, or None for the default
+        :return: True if the request may proceed, False if it is over budget
+        """
+        wait = self.reserve(host, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait > 0:
+            sleep(wait)
+        return True
@@ -0,0 +1,282 @@
+# Copyright (C) 2021, Steven Cooper
+#
+# This file is part of rpi-clock.
+#
+# Rpi-clock is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rpi-clock is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rpi-clock.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Record/replay support for offline data source testing and benchmarking.
+
+ResponseRecorder captures responses received by data sources. ReplayServer is
+a local HTTP stand-in that serves them back with configurable latency, errors,
+and throttling.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .logger import log
+from .typing import Interval
+
+RECORDINGS_FILE_NAME = 'recordings.json'
+BODY_EXTENSION = '.body'
+DEFAULT_REPLAY_PORT = 8080
+
+# Headers that describe the recorded transfer, rather than the content.
+TRANSFER_HEADERS = {'connection', 'content-encoding', 'content-length', 'keep-alive',
+                    'transfer-encoding'}
+
+
+@dataclass
+class Recording:
+    """Recorded response."""
+    url: str
+    """Original request URL."""
+    status: int
+    """HTTP status code."""
+    headers: List[Tuple[str, str]]
+    """Response headers."""
+    body_file: Optional[str]
+    """Body file name in the recordings folder, if there is a body."""
+    elapsed: float
+    """Original request duration in seconds."""
+
+
+def get_recording_key(url: str) -> str:
+    """
+    Generate a host-independent recording key for a URL.
+
+    :param url: full URL or path with optional query
+    :return: path and query key
+    """
+    parts = urlsplit(url)
+    return f'{parts.path or "/"}?{parts.query}' if parts.query else parts.path or '/'
+
+
+class ResponseRecorder:
+    """Records responses by URL path and query to a folder."""
+
+    def __init__(self, folder: str):
+        """
+        Response recorder constructor.
+
+        Existing recordings in the folder are kept, and replaced when the same
+        URL is recorded again.
+
+        :param folder: recordings folder path
+        """
+        self.folder = folder
+        self.recordings = load_recordings(folder)
+        self._lock = threading.Lock()
+
+    def record(self,
+               url: str,
+               status: int,
+               headers: List[Tuple[str, str]],
+               body: Optional[bytes],
+               elapsed: float):
+        """
+        Record a response.
+
+        :param url: request URL
+        :param status: HTTP status code
+        :param headers: response headers
+        :param body: decoded response body, if any
+        :param elapsed: request duration in seconds
+        """
+        key = get_recording_key(url)
+        body_file = None
+        with self._lock:
+            os.makedirs(self.folder, exist_ok=True)
+            if body:
+                body_file = hashlib.sha1(key.encode('utf-8')).hexdigest() + BODY_EXTENSION
+                with open(os.path.join(self.folder, body_file), 'wb') as open_file:
+                    open_file.write(body)
+            self.recordings[key] = Recording(url, status, headers, body_file, elapsed)
+            with open(os.path.join(self.folder, RECORDINGS_FILE_NAME), 'w', encoding='utf-8') as open_file:
+                json.dump({record_key: asdict(recording)
+                           for record_key, recording in self.recordings.items()},
+                          open_file,
+                          indent=2)
+
+
+def load_recordings(folder: str) -> Dict[str, Recording]:
+    """
+    Load recordings from a folder.
+
+    :param folder: recordings folder path
+    :return: recordings by key, empty if there are no recordings
+    """
+    path = os.path.join(folder, RECORDINGS_FILE_NAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding='utf-8') as open_file:
+        return {key: Recording(**{**data, 'headers': [tuple(header) for header in data['headers']]})
+                for key, data in json.load(open_file).items()}
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Local HTTP server that replays recorded responses.
+
+    Supports conditional requests and gzip encoding, and can simulate latency,
+    server errors, and rate-limit (429) throttling. Random behavior is seeded
+    for reproducible runs.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 folder: str,
+                 port: int = DEFAULT_REPLAY_PORT,
+                 host: str = '',
+                 latency: Interval = 0,
+                 latency_jitter: Interval = 0,
+                 recorded_latency: bool = False,
+                 error_rate: float = 0,
+                 max_rate: float = None,
+                 seed: int = 0):
+        """
+        Replay server constructor.
+
+        :param folder: recordings folder path
+        :param port: listening port
+        :param host: listening host address (default: all)
+        :param latency: added response latency in seconds
+        :param latency_jitter: maximum random extra latency in seconds
+        :param recorded_latency: add originally-recorded request durations if True
+        :param error_rate: fraction of requests that fail with 503 errors
+        :param max_rate: maximum requests per second before 429 responses
+        :param seed: random number generator seed
+        """
+        super().__init__((host, port), ReplayRequestHandler)
+        self.folder = folder
+        self.recordings = load_recordings(folder)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.recorded_latency = recorded_latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.random = random.Random(seed)
+        self.request_times: Deque[float] = deque()
+        self.lock = threading.Lock()
+        log.info(f'Replaying {len(self.recordings)} recordings from "{folder}".')
+
+    def is_throttled(self) -> bool:
+        """
+        Check and update the request rate over the last second.
+
+        :return: True if the request should be throttled
+        """
+        if self.max_rate is None:
+            return False
+        with self.lock:
+            now = time()
+            while self.request_times and now - self.request_times[0] > 1:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.max_rate:
+                return True
+            self.request_times.append(now)
+            return False
+
+    def get_delay(self, recording: Optional[Recording]) -> float:
+        """
+        Calculate simulated latency.
+
+        :param recording: recording for the request, if found
+        :return: delay in seconds
+        """
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if self.recorded_latency and recording is not None:
+            delay += recording.elapsed
+        return delay
+
+    def is_error(self) -> bool:
+        """
+        Decide whether to simulate a server error.
+
+        :return: True if the request should fail
+        """
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """Replay server request handler."""
+
+    protocol_version = 'HTTP/1.1'
+    server: ReplayServer
+
+    # noinspection PyPep8Naming
+    def do_GET(self):
+        """Handle GET request."""
+        recording = self.server.recordings.get(get_recording_key(self.path))
+        sleep(self.server.get_delay(recording))
+        if self.server.is_throttled():
+            self._send_status(429, [('Retry-After', '1')])
+            return
+        if self.server.is_error():
+            self._send_status(503)
+            return
+        if recording is None:
+            self._send_status(404)
+            return
+        headers = [(name, value) for name, value in recording.headers
+                   if name.lower() not in TRANSFER_HEADERS]
+        etag = dict((name.lower(), value) for name, value in headers).get('etag')
+        if etag and self.headers.get('If-None-Match') == etag:
+            self._send_status(304, headers)
+            return
+        body = b''
+        if recording.body_file:
+            with open(os.path.join(self.server.folder, recording.body_file), 'rb') as open_file:
+                body = open_file.read()
+        if body and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        self.send_response(recording.status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format_string: str, *args):
+        """
+        Send request logging to the common logger.
+
+        :param format_string: message format string
+        :param args: message format arguments
+        """
+        log.info(f'Replay: {format_string % args}')
+
+    def _send_status(self, status: int, headers: List[Tuple[str, str]] = None):
+        self.send_response(status)
+        for name, value in headers or []:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()